@@ -1,6 +1,17 @@
-from flask import Flask, request, jsonify
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from service.llm_gimi import QCMGenerator
+from service.batch_generation import BatchGenerator, BatchItemError
+from service.ingestion_jobs import IngestionJobQueue
+from service.metrics import metrics
+from service.resources import resources
+from service.upload_store import UploadStore
+import json
+import multiprocessing
 import os
+import threading
 from dotenv import load_dotenv
 import traceback
 from werkzeug.utils import secure_filename
@@ -20,65 +31,444 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('chroma_db', exist_ok=True)
 os.makedirs('metadata', exist_ok=True)
 
-# Initialiser le générateur de QCM
-qcm_generator = QCMGenerator()
+# Les PDF envoyés sont stockés une seule fois, sous le hash de leur contenu
+upload_store = UploadStore(UPLOAD_FOLDER)
+
+# Le générateur de QCM (modèle d'embedding, client Chroma, clients Gemini)
+# et la file d'ingestion sont créés au premier usage, pas à l'import
+_qcm_generator = None
+_ingestion_jobs = None
+_batch_generator = None
+_resources_lock = threading.Lock()
+
+def get_qcm_generator():
+    """Générateur de QCM partagé par toutes les requêtes du processus"""
+    global _qcm_generator
+    if _qcm_generator is None:
+        with _resources_lock:
+            if _qcm_generator is None:
+                start = time.perf_counter()
+                generator = QCMGenerator()
+                resources.record("qcm_generator", time.perf_counter() - start)
+                _qcm_generator = generator
+    return _qcm_generator
+
+def get_ingestion_jobs():
+    """File d'attente d'ingestion asynchrone des PDF"""
+    global _ingestion_jobs
+    rag_service = get_qcm_generator().rag_service
+    if _ingestion_jobs is None:
+        with _resources_lock:
+            if _ingestion_jobs is None:
+                _ingestion_jobs = IngestionJobQueue(rag_service, upload_store=upload_store)
+    return _ingestion_jobs
+
+def get_batch_generator():
+    """Génération en lot, avec son pool partagé par toutes les requêtes du processus"""
+    global _batch_generator
+    qcm_generator = get_qcm_generator()
+    if _batch_generator is None:
+        with _resources_lock:
+            if _batch_generator is None:
+                _batch_generator = BatchGenerator(qcm_generator, upload_store=upload_store)
+    return _batch_generator
+
+def warm_up():
+    """Précharger le modèle d'embedding et les clients, p.ex. depuis un hook post_fork de gunicorn"""
+    resources.warm_up(get_qcm_generator().rag_service.embedding_engine)
+    get_ingestion_jobs()
+    print(f"Warm-up done: {resources.startup_report()['stages']}")
+
+# WARMUP_ON_START=1 charge tout en arrière-plan dès le démarrage du worker
+# (pas dans les processus d'ingestion, qui réimportent ce module au démarrage)
+if os.environ.get("WARMUP_ON_START", "0").lower() in ("1", "true", "yes") and multiprocessing.parent_process() is None:
+    threading.Thread(target=warm_up, name="qcm-warm-up", daemon=True).start()
+
+@app.before_request
+def start_request_metrics():
+    """Démarrer le chronométrage de la requête et la comptabiliser comme en cours"""
+    g.request_started = time.perf_counter()
+    g.request_timings, g.request_timings_token = metrics.start_request_timings()
+    metrics.gauge_add("qcm_requests_in_flight", 1, labels={'endpoint': request.endpoint or 'unknown'})
+
+@app.after_request
+def record_request_metrics(response):
+    labels = {'endpoint': request.endpoint or 'unknown'}
+    started = g.request_started
+
+    def record():
+        metrics.observe("qcm_http_request_duration_seconds", time.perf_counter() - started, labels=labels)
+        metrics.inc("qcm_http_requests_total", labels={**labels, 'status': str(response.status_code)})
+
+    if response.is_streamed:
+        # Only the headers are sent at this point, the body once the stream
+        # ends: the request stays in flight until then
+        g.request_streamed = True
+        response.call_on_close(record)
+        response.call_on_close(lambda: metrics.gauge_add("qcm_requests_in_flight", -1, labels=labels))
+    else:
+        record()
+    return response
+
+@app.teardown_request
+def stop_request_metrics(exception=None):
+    # Streamed responses tear the request down twice (after the view and
+    # after the stream), only the first one counts; their in-flight gauge
+    # is released when the response is closed
+    token = g.pop('request_timings_token', None)
+    if token is not None:
+        metrics.stop_request_timings(token)
+        if not g.get('request_streamed'):
+            metrics.gauge_add("qcm_requests_in_flight", -1, labels={'endpoint': request.endpoint or 'unknown'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métriques au format Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """État du processus et temps de démarrage par ressource"""
+    return jsonify({'status': 'ok', 'ready': _qcm_generator is not None, 'startup': resources.startup_report()})
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_flag(value, default=False):
+    """Interpréter un booléen venant du JSON ou d'un formulaire"""
+    if value is None or value == '':
+        return default
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def prepare_document(json_data):
+    """Ingest the uploaded PDF or load the referenced document_id.
+    Returns (document_info, error_response); document_info['session'] is the
+    request's own DocumentSession on the document"""
+    document_info = {'has_pdf': False, 'filename': None, 'document_id': None, 'stats': None, 'session': None}
+    
+    # Check if there's a file in the request
+    if 'file' in request.files:
+        file = request.files['file']
+        if file.filename == '':
+            return None, (jsonify({'error': 'No selected file', 'status': 'error'}), 400)
+        
+        if file and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            stored = upload_store.save(file.stream)
+            
+            # Process the PDF file; a document seen before reuses its index
+            # right away, without parsing or embedding it again
+            try:
+                # Pinned: the upload cleanup must not remove the file while it is read
+                with upload_store.pinned(stored.path):
+                    session = get_qcm_generator().rag_service.process_pdf(stored.path, document_id=stored.document_id,
+                                                                          filename=filename)
+                document_info['session'] = session
+                document_info['duplicate_upload'] = stored.duplicate
+                document_info['document_id'] = session.document_id
+                # Get document statistics
+                document_info['stats'] = session.stats()
+                document_info['filename'] = filename
+                document_info['has_pdf'] = True
+            except Exception as e:
+                return None, (jsonify({'error': f'Error processing PDF: {str(e)}', 'status': 'error'}), 500)
+    
+    # Target a document that was already indexed, without re-uploading it,
+    # either directly or through the ingestion job that indexed it
+    elif json_data and (json_data.get('document_id') or json_data.get('job_id')):
+        document_id = json_data.get('document_id')
+        if not document_id:
+            job = get_ingestion_jobs().get(json_data['job_id'])
+            if job is None:
+                return None, (jsonify({'error': f"Unknown job_id: {json_data['job_id']}", 'status': 'error'}), 404)
+            if parse_flag(json_data.get('wait')):
+                job.wait(timeout=float(json_data.get('wait_timeout', 300)))
+            if job.status == 'failed':
+                return None, (jsonify({'error': job.error, 'status': 'error', 'job': job.to_dict()}), 500)
+            if job.status != 'done':
+                return None, (jsonify({'error': 'Document is still being ingested', 'status': 'pending', 'job': job.to_dict()}), 409)
+            document_id = job.document_id
+        
+        session = get_qcm_generator().rag_service.load_document(document_id)
+        if session is None:
+            return None, (jsonify({'error': f'Unknown or expired document_id: {document_id}', 'status': 'error'}), 404)
+        document_info['session'] = session
+        document_info['document_id'] = document_id
+        document_info['stats'] = session.stats()
+        document_info['filename'] = session.metadata.get('filename')
+        document_info['has_pdf'] = True
+    
+    return document_info, None
+
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest_pdf():
+    """Enregistre le PDF et lance son ingestion en arrière-plan ; renvoie
+    immédiatement l'identifiant du job"""
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'No selected file', 'status': 'error'}), 400
+        
+        file = request.files['file']
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Only PDF files are supported', 'status': 'error'}), 400
+        
+        filename = secure_filename(file.filename)
+        stored = upload_store.save(file.stream)
+        
+        job = get_ingestion_jobs().submit(stored.path, filename, document_id=stored.document_id)
+        return jsonify({'status': 'accepted', 'job': job.to_dict()}), 202
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+@app.route('/api/ingest/<job_id>', methods=['GET'])
+def api_ingest_status(job_id):
+    """Statut et progression d'un job d'ingestion"""
+    job = get_ingestion_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job_id: {job_id}', 'status': 'error'}), 404
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+@app.route('/api/documents', methods=['GET'])
+def api_list_documents():
+    """Historique paginé des documents traités (?page=1&per_page=20&filename=...)"""
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers', 'status': 'error'}), 400
+    
+    documents, total = get_qcm_generator().rag_service.metadata_store.list_entries(
+        offset=(page - 1) * per_page, limit=per_page, filename=request.args.get('filename'))
+    return jsonify({
+        'status': 'success',
+        'documents': documents,
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page
+        }
+    })
+
+@app.route('/api/documents/<document_id>', methods=['GET'])
+def api_get_document(document_id):
+    """Dernières métadonnées enregistrées pour un document (hash du contenu)"""
+    metadata = get_qcm_generator().rag_service.metadata_store.get(document_id)
+    if metadata is None:
+        return jsonify({'error': f'Unknown document_id: {document_id}', 'status': 'error'}), 404
+    return jsonify({'status': 'success', 'document': metadata})
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate_qcm():
     """Endpoint API dédié pour générer des questions (format JSON uniquement)"""
     try:
-        has_pdf = False
-        filename = None
-        stats = None
-        
-        # Check if there's a file in the request
-        if 'file' in request.files:
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'No selected file', 'status': 'error'}), 400
-            
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                
-                # Process the PDF file
-                try:
-                    qcm_generator.rag_service.process_pdf(filepath)
-                    # Get document statistics
-                    stats = qcm_generator.rag_service.get_document_stats()
-                    has_pdf = True
-                except Exception as e:
-                    return jsonify({'error': f'Error processing PDF: {str(e)}', 'status': 'error'}), 500
-        
         # Get JSON data from form data if not in request.json
         # json_data = request.json if request.json else request.form.to_dict()
         json_data = request.get_json(silent=True) or request.form.to_dict()
-
         
-        # Use handle_json_request for question generation
-        response = handle_json_request(json_data, has_pdf)
+        document_info, error_response = prepare_document(json_data)
+        if error_response:
+            return error_response
+        has_pdf = document_info['has_pdf']
+        
+        # Use handle_json_request for question generation; closing the
+        # session lets the document be evicted again
+        try:
+            response = handle_json_request(json_data, has_pdf, session=document_info['session'])
+        finally:
+            if document_info['session'] is not None:
+                document_info['session'].close()
+        
+        include_timings = parse_flag((json_data or {}).get('include_timings'))
+        if isinstance(response, tuple) or response.status_code != 200 or not (has_pdf or include_timings):
+            return response
+        
+        response_data = response.get_json()
         
         # If we have a PDF, add file information to the response
-        if has_pdf and response.status_code == 200:
-            response_data = response.get_json()
+        if has_pdf:
             response_data['metadata'].update({
-                'filename': filename,
-                'document_stats': stats
+                'filename': document_info['filename'],
+                'document_id': document_info['document_id'],
+                'document_stats': document_info['stats'],
+                'duplicate_upload': document_info.get('duplicate_upload', False),
+                'embedding_cache': get_qcm_generator().rag_service.get_embedding_cache_stats(),
+                'embedding_engine': get_qcm_generator().rag_service.get_embedding_stats()
             })
-            return jsonify(response_data)
+        
+        # Optional per-stage timing breakdown of this request, with the LLM queue state
+        if include_timings:
+            response_data['metadata']['timings'] = g.request_timings.breakdown()
+            response_data['metadata']['llm_gateway'] = get_qcm_generator().gateway.stats()
+        
+        return jsonify(response_data)
             
-        return response
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+@app.route('/api/generate/stream', methods=['POST'])
+def api_generate_qcm_stream():
+    """Variante streaming de /api/generate : chaque question est envoyée dès
+    qu'elle est générée, en NDJSON (par défaut) ou en Server-Sent Events
+    (?format=sse ou Accept: text/event-stream)"""
+    try:
+        json_data = request.get_json(silent=True) or request.form.to_dict()
+        
+        document_info, error_response = prepare_document(json_data)
+        if error_response:
+            return error_response
+        
+        # The session is closed once the response is, or right away when no stream is sent
+        session = document_info['session']
+        response = None
+        try:
+            if not json_data and not document_info['has_pdf']:
+                return jsonify({'error': 'Données JSON requises', 'status': 'error'}), 400
+        
+            num_open_questions = int(json_data.get('num_open_questions', 0))
+            num_yes_no_questions = int(json_data.get('num_yes_no_questions', 0))
+            if num_open_questions == 0 and num_yes_no_questions == 0:
+                return jsonify({'error': 'Veuillez spécifier au moins un type de question à générer', 'status': 'error'}), 400
+        
+            text_content = ""
+            if not document_info['has_pdf']:
+                text_content = json_data.get('text_content', '')
+                if not text_content:
+                    return jsonify({'error': 'Text content is required when no PDF is provided', 'status': 'error'}), 400
+        
+            use_cache = parse_flag(json_data.get('use_cache'), default=True)
+            use_sse = (request.args.get('format') == 'sse'
+                       or 'text/event-stream' in request.headers.get('Accept', ''))
+        
+            def format_event(event, payload):
+                if use_sse:
+                    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                return json.dumps({'event': event, **payload}, ensure_ascii=False) + "\n"
+        
+            def generate():
+                total = 0
+                generation_metadata = {}
+                try:
+                    for question in get_qcm_generator().stream_questions_from_text(
+                        text_content=text_content,
+                        num_open_questions=num_open_questions,
+                        num_yes_no_questions=num_yes_no_questions,
+                        use_cache=use_cache,
+                        session=session,
+                        generation_metadata=generation_metadata
+                    ):
+                        total += 1
+                        yield format_event('question', {'question': question})
+                except Exception as e:
+                    traceback.print_exc()
+                    yield format_event('error', {'error': str(e), 'status': 'error'})
+                    return
             
+                # Échecs et délais dépassés sont rapportés par type de question
+                generation_status = generation_metadata.get('status', {})
+                done = {
+                    'status': QCMGenerator.generation_outcome(generation_status, total),
+                    'metadata': {
+                        'total_questions': total,
+                        'open_questions': num_open_questions,
+                        'yes_no_questions': num_yes_no_questions,
+                        'filename': document_info['filename'],
+                        'document_id': document_info['document_id'],
+                        'document_stats': document_info['stats'],
+                        'cache': generation_metadata.get('cache', {}),
+                        'generation_status': generation_status
+                    }
+                }
+                if generation_metadata.get('errors'):
+                    done['error'] = "; ".join(f"{question_type}: {error}"
+                                              for question_type, error in generation_metadata['errors'].items())
+                yield format_event('done', done)
+        
+            mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+            response = Response(stream_with_context(generate()), mimetype=mimetype,
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            if session is not None:
+                response.call_on_close(session.close)
+            return response
+        finally:
+            if response is None and session is not None:
+                session.close()
+    
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
-def handle_json_request(json_data, has_pdf=False):
-    """Traiter les requêtes au format JSON"""
+@app.route('/api/generate/batch', methods=['POST'])
+def api_generate_qcm_batch():
+    """Génération pour plusieurs documents en un appel. Corps JSON
+    {"items": [{"id", "text_content" | "document_id", "num_open_questions",
+    "num_yes_no_questions"}, ...]} ou multipart avec le champ "items" en JSON
+    et les PDF en fichiers ("file": nom du champ). Les résultats sont
+    renvoyés en NDJSON, un par élément dès qu'il est prêt, avec ses propres
+    erreurs"""
+    try:
+        json_data = request.get_json(silent=True)
+        if json_data is None:
+            json_data = request.form.to_dict()
+            try:
+                json_data['items'] = json.loads(json_data.get('items') or '[]')
+            except ValueError:
+                return jsonify({'error': 'items must be a JSON list', 'status': 'error'}), 400
+        
+        # Uploaded PDFs, referenced by their form field name
+        files = {}
+        for field, file in request.files.items():
+            if file.filename == '' or not allowed_file(file.filename):
+                return jsonify({'error': f'Only PDF files are supported ({field})', 'status': 'error'}), 400
+            stored = upload_store.save(file.stream)
+            files[field] = {'path': stored.path, 'filename': secure_filename(file.filename),
+                            'document_id': stored.document_id}
+        
+        batch_generator = get_batch_generator()
+        try:
+            items = batch_generator.validate(json_data.get('items'), defaults=json_data, files=files)
+        except BatchItemError as e:
+            return jsonify({'error': str(e), 'status': 'error'}), 400
+        use_cache = parse_flag(json_data.get('use_cache'), default=True)
+        
+        def generate():
+            start = time.perf_counter()
+            succeeded = 0
+            partial = 0
+            for result in batch_generator.run(items, use_cache=use_cache):
+                succeeded += result['status'] == 'success'
+                partial += result['status'] == 'partial'
+                yield json.dumps({'event': 'item', **result}, ensure_ascii=False) + "\n"
+            if succeeded == len(items):
+                status = 'success'
+            else:
+                status = 'partial' if succeeded or partial else 'error'
+            yield json.dumps({
+                'event': 'done',
+                'status': status,
+                'metadata': {
+                    'total_items': len(items),
+                    'succeeded': succeeded,
+                    'partial': partial,
+                    'failed': len(items) - succeeded - partial,
+                    'seconds': round(time.perf_counter() - start, 3),
+                    'llm_gateway': get_qcm_generator().gateway.stats()
+                }
+            }, ensure_ascii=False) + "\n"
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+def handle_json_request(json_data, has_pdf=False, session=None):
+    """Traiter les requêtes au format JSON ; session est le document de la
+    requête quand has_pdf est vrai"""
     if not json_data:
         return jsonify({'error': 'Données JSON requises', 'status': 'error'}), 400
     
@@ -90,14 +480,21 @@ def handle_json_request(json_data, has_pdf=False):
     if num_open_questions == 0 and num_yes_no_questions == 0:
         return jsonify({'error': 'Veuillez spécifier au moins un type de question à générer', 'status': 'error'}), 400
     
+    # Cached question sets are used unless the request opts out
+    use_cache = parse_flag(json_data.get('use_cache'), default=True)
+    generation_metadata = {}
+    
     # Generate questions
     try:
         if has_pdf:
             # If we have a processed PDF, use the vector store
-            questions = qcm_generator.generate_questions_from_text(
+            questions = get_qcm_generator().generate_questions_from_text(
                 text_content="",  # Empty text as we're using the processed PDF
                 num_open_questions=num_open_questions,
-                num_yes_no_questions=num_yes_no_questions
+                num_yes_no_questions=num_yes_no_questions,
+                use_cache=use_cache,
+                generation_metadata=generation_metadata,
+                session=session
             )
         else:
             # If no PDF, require text content
@@ -105,24 +502,36 @@ def handle_json_request(json_data, has_pdf=False):
             if not text_content:
                 return jsonify({'error': 'Text content is required when no PDF is provided', 'status': 'error'}), 400
             
-            questions = qcm_generator.generate_questions_from_text(
+            questions = get_qcm_generator().generate_questions_from_text(
                 text_content=text_content,
                 num_open_questions=num_open_questions,
-                num_yes_no_questions=num_yes_no_questions
+                num_yes_no_questions=num_yes_no_questions,
+                use_cache=use_cache,
+                generation_metadata=generation_metadata
             )
         
+        # Échecs et délais dépassés sont rapportés par type de question
         return jsonify({
-            'status': 'success',
+            'status': QCMGenerator.generation_outcome(generation_metadata.get('status', {}), len(questions)),
             'questions': questions,
             'metadata': {
                 'total_questions': len(questions),
                 'open_questions': num_open_questions,
-                'yes_no_questions': num_yes_no_questions
+                'yes_no_questions': num_yes_no_questions,
+                'cache': generation_metadata.get('cache', {}),
+                'context': generation_metadata.get('context', {}),
+                'index': generation_metadata.get('index'),
+                'generation_status': generation_metadata.get('status', {})
             }
         })
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': f'Erreur lors de la génération des questions: {str(e)}', 'status': 'error'}), 500
 
+resources.record("app_import", time.perf_counter() - APP_IMPORT_STARTED)
+
 if __name__ == '__main__':
+    # Seul le processus relancé par le reloader sert les requêtes
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import random
+from typing import List
+
+WORDS = (
+    "apprentissage modèle donnée réseau neurone algorithme fonction erreur gradient couche "
+    "entrée sortie poids biais optimisation validation test classification régression "
+    "learning model data network neuron algorithm function error gradient layer input "
+    "output weight bias optimisation validation test classification regression"
+).split()
+
+
+def synthetic_paragraph(rng: random.Random, sentences: int = 6) -> str:
+    """A paragraph of pseudo-sentences drawn from a small course vocabulary"""
+    result = []
+    for _ in range(sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        result.append(" ".join(words).capitalize() + ".")
+    return " ".join(result)
+
+
+def synthetic_text(num_paragraphs: int = 20, seed: int = 0) -> str:
+    """Deterministic synthetic course text"""
+    rng = random.Random(seed)
+    return "\n\n".join(synthetic_paragraph(rng) for _ in range(num_paragraphs))
+
+
+def synthetic_pages(num_pages: int, paragraphs_per_page: int = 4, seed: int = 0) -> List[str]:
+    """Deterministic page texts, each with a running header and footer like real course packs"""
+    rng = random.Random(seed)
+    return [
+        "\n".join(
+            ["Cours d'apprentissage automatique - Chapitre 1"]
+            + [synthetic_paragraph(rng) for _ in range(paragraphs_per_page)]
+            + [f"Page {page + 1}"]
+        )
+        for page in range(num_pages)
+    ]
+
+
+def _wrap(text: str, width: int = 90) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.append(line)
+    return lines
+
+
+def _escape(line: str) -> bytes:
+    encoded = line.encode("latin-1", errors="replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def write_pdf(path: str, pages: List[str]) -> None:
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for text in pages:
+        content = b"BT /F1 10 Tf 12 TL 50 800 Td\n"
+        for line in _wrap(text)[:64]:
+            content += b"(" + _escape(line) + b") Tj T*\n"
+        content += b"ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def synthetic_pdf(path: str, num_pages: int = 20, seed: int = 0) -> str:
+    """Write a deterministic synthetic course PDF and return its path"""
+    write_pdf(path, synthetic_pages(num_pages, seed=seed))
+    return path
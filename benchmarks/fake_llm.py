@@ -0,0 +1,84 @@
+import json
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModels:
+    """Stand-in for genai.Client().models answering with canned question JSON"""
+
+    def __init__(self, latency: float, jitter: float, seconds_per_question: float,
+                 stream_chunk_size: int, failure_rate: float, seed: Optional[int]):
+        self.latency = latency
+        self.jitter = jitter
+        self.seconds_per_question = seconds_per_question
+        self.stream_chunk_size = stream_chunk_size
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def _canned_response(self, contents, config=None) -> str:
+        prompt = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            failed = self.random.random() < self.failure_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        match = re.search(r"Generate (\d+)", prompt)
+        num_questions = int(match.group(1)) if match else 1
+        time.sleep(delay + self.seconds_per_question * num_questions)
+
+        if failed:
+            return "Sorry, I cannot help with that."
+
+        # Random tags keep the questions distinct enough to survive deduplication
+        with self._lock:
+            tags = [f"{self.random.getrandbits(64):016x}" for _ in range(num_questions)]
+        if "yes/no questions" in prompt:
+            questions = [
+                {'question': f"Is statement {tag} supported by the text?", 'answer': 'yes',
+                 'justification': f"The text states fact {tag}."}
+                for tag in tags
+            ]
+        else:
+            questions = [
+                {'question': f"Explain concept {tag} described in the text.",
+                 'reference_answer': f"Concept {tag} is explained in the text."}
+                for tag in tags
+            ]
+        text = json.dumps({'questions': questions}, indent=2)
+        # Without a JSON response MIME type, Gemini tends to wrap the JSON in a code fence
+        if getattr(config, 'response_mime_type', None) == "application/json":
+            return text
+        return "```json\n" + text + "\n```"
+
+    def generate_content(self, model, contents, config=None):
+        return FakeResponse(self._canned_response(contents, config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        text = self._canned_response(contents, config)
+        for i in range(0, len(text), self.stream_chunk_size):
+            yield FakeResponse(text[i:i + self.stream_chunk_size])
+
+
+class FakeGenaiClient:
+    """
+    Local replacement for genai.Client, injected into QCMGenerator(client=...).
+    Every call sleeps latency + U(0, jitter) + seconds_per_question * N, then
+    answers with N canned questions in the JSON shape the prompts request;
+    failure_rate of the calls answer with non-JSON text instead
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, seconds_per_question: float = 0.0,
+                 stream_chunk_size: int = 64, failure_rate: float = 0.0, seed: Optional[int] = 0):
+        self.models = FakeModels(latency, jitter, seconds_per_question, stream_chunk_size, failure_rate, seed)
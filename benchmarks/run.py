@@ -0,0 +1,290 @@
+"""
+Offline benchmark suite: runs the ingest, retrieval, prompt and API hot
+paths against a synthetic corpus and a local Gemini stand-in, and prints
+p50/p95/p99 latencies and throughput as JSON.
+
+    python -m benchmarks.run --scenarios ingest retrieval prompt api --output bench.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+# Allow running as a script from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_pages, synthetic_pdf, synthetic_text, write_pdf
+from benchmarks.fake_llm import FakeGenaiClient
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: List[float], items_per_sample: float = 1.0, wall_seconds: float = None) -> Dict:
+    """Latency percentiles (ms) and throughput (items/s) of a list of timings in seconds"""
+    if not samples:
+        return {'count': 0}
+    total = wall_seconds if wall_seconds is not None else sum(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'throughput_per_s': round(len(samples) * items_per_sample / total, 3) if total else None
+    }
+
+
+def timed(function: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_ingest(args) -> Dict:
+    from langchain_community.vectorstores import Chroma
+    from service.rag_service import RAGService
+
+    rag_service = RAGService()
+    stages = {'load': [], 'split': [], 'embed': [], 'index': []}
+    chunk_counts = []
+    for i in range(args.iterations):
+        # A different document per iteration, so the embedding cache stays cold
+        path = synthetic_pdf(os.path.join(args.workdir, f"ingest_{i}.pdf"), args.pages, seed=1000 + i)
+
+        # The extractor process_pdf reads pages with (pool and page cache)
+        pages, seconds = timed(rag_service.pdf_extractor.extract, path)
+        stages['load'].append(seconds)
+        chunks, seconds = timed(rag_service.text_splitter.split_documents, pages)
+        stages['split'].append(seconds)
+        chunk_counts.append(len(chunks))
+        _, seconds = timed(rag_service.embeddings.embed_documents, [chunk.page_content for chunk in chunks])
+        stages['embed'].append(seconds)
+
+        # Embeddings are now cached, so this measures the vector store write
+        vector_store = Chroma(client=rag_service.chroma_client, collection_name=f"bench_ingest_{i}",
+                              embedding_function=rag_service.embeddings)
+        _, seconds = timed(vector_store.add_documents, chunks)
+        stages['index'].append(seconds)
+        rag_service.registry.drop_collection(f"bench_ingest_{i}")
+
+    chunks_per_doc = statistics.fmean(chunk_counts)
+    result = {stage: summarize(samples) for stage, samples in stages.items()}
+    result['embed']['chunks_per_s'] = round(sum(chunk_counts) / sum(stages['embed']), 3)
+    result['chunks_per_document'] = chunks_per_doc
+    return result
+
+
+def bench_extract(args) -> Dict:
+    """PDF text extraction: in-process vs process pool on a cold cache, then
+    a revised copy of the same PDF (one page changed) through the page cache"""
+    from service.pdf_extraction import PageTextCache, PdfExtractor
+
+    pages = synthetic_pages(args.pages * 10, seed=11)
+    path = os.path.join(args.workdir, "extract.pdf")
+    write_pdf(path, pages)
+    revised_path = os.path.join(args.workdir, "extract_revised.pdf")
+    write_pdf(revised_path, pages[:1] + ["Revised page"] + pages[2:])
+
+    result = {'pages': len(pages)}
+    for name, processes in (('serial', 1), ('pool', os.cpu_count() or 1)):
+        extractor = PdfExtractor(max_processes=processes)
+        if processes > 1:
+            # Exclude the pool start-up from the timings
+            extractor.extract(path)
+        samples = [timed(extractor.extract, path)[1] for _ in range(args.iterations)]
+        result[name] = summarize(samples, items_per_sample=len(pages))
+        result[name]['processes'] = processes
+
+    cache = PageTextCache(os.path.join(args.workdir, "pdf_cache", "pages.sqlite"))
+    extractor = PdfExtractor(cache, max_processes=1)
+    _, cold = timed(extractor.extract, path)
+    _, revised = timed(extractor.extract, revised_path)
+    result['revised'] = {
+        'cold_seconds': round(cold, 4),
+        'revised_seconds': round(revised, 4),
+        'pages_reextracted': cache.misses - len(pages)
+    }
+    return result
+
+
+def bench_chunking(args) -> Dict:
+    """Character splitter (1000/200) vs tokenizer splitter sized to the
+    embedding model's sequence limit, on the same pages"""
+    from service.rag_service import RAGService, make_text_splitter
+    from service.resources import resources
+
+    rag_service = RAGService()
+    engine = rag_service.embedding_engine
+    tokenizer = resources.tokenizer(rag_service.embedding_model)
+    max_tokens = engine.max_seq_length
+    splitters = {
+        'chars': make_text_splitter(1000, 200),
+        'tokens': make_text_splitter(max_tokens - 2, int(os.environ.get("CHUNK_OVERLAP_TOKENS", 32)),
+                                     rag_service.embedding_model)
+    }
+
+    pages = []
+    for i in range(args.iterations):
+        pages += rag_service.pdf_extractor.extract(
+            synthetic_pdf(os.path.join(args.workdir, f"chunking_{i}.pdf"), args.pages, seed=2000 + i))
+
+    result = {'max_seq_length': max_tokens, 'pages': len(pages)}
+    for name, splitter in splitters.items():
+        chunks, split_seconds = timed(splitter.split_documents, pages)
+        texts = [chunk.page_content for chunk in chunks]
+        # Straight to the model: the embedding cache would hide the cost
+        vectors, embed_seconds = timed(engine.embed_documents, texts)
+
+        # Sequence length as the model sees it, special tokens included
+        lengths = [len(tokenizer(text)['input_ids']) for text in texts]
+        truncated = [length - max_tokens for length in lengths if length > max_tokens]
+        dimension = len(vectors[0]) if vectors else 0
+        result[name] = {
+            'chunks': len(chunks),
+            'split_seconds': round(split_seconds, 4),
+            'embed_seconds': round(embed_seconds, 4),
+            'chunks_per_s': round(len(chunks) / (split_seconds + embed_seconds), 3) if chunks else None,
+            'tokens_per_chunk': round(statistics.fmean(lengths), 1) if lengths else 0,
+            'truncation_rate': round(len(truncated) / len(chunks), 4) if chunks else 0.0,
+            'tokens_truncated': sum(truncated),
+            'index_bytes': sum(len(text.encode("utf-8")) for text in texts) + len(vectors) * dimension * 4
+        }
+    return result
+
+
+def bench_retrieval(args) -> Dict:
+    from service.rag_service import RAGService
+
+    rag_service = RAGService()
+    session = rag_service.process_pdf(synthetic_pdf(os.path.join(args.workdir, "retrieval.pdf"), args.pages, seed=7))
+
+    result = {}
+    for strategy in ("similarity", "mmr", "kmeans", "stratified"):
+        samples = []
+        for _ in range(args.iterations):
+            _, seconds = timed(rag_service.get_context_for_question, session, "open", args.questions,
+                               strategy=strategy)
+            samples.append(seconds)
+        result[strategy] = summarize(samples)
+    session.close()
+    return result
+
+
+def bench_prompt(args) -> Dict:
+    from service.llm_gimi import QCMGenerator
+    from service.rag_service import RAGService
+
+    # Zero-latency stand-in: only prompt assembly and response parsing remain
+    generator = QCMGenerator(client=FakeGenaiClient(latency=0.0, jitter=0.0), rag_service=RAGService())
+    context_chunks = synthetic_text(args.questions, seed=3).split("\n\n")
+
+    result = {}
+    for question_type in ('open', 'yes_no'):
+        samples = []
+        for _ in range(args.iterations):
+            _, seconds = timed(generator._generate_group, question_type, context_chunks, args.questions, "fake-model")
+            samples.append(seconds)
+        result[question_type] = summarize(samples)
+    return result
+
+
+def bench_api(args) -> Dict:
+    os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    import app as app_module
+
+    fake_client = FakeGenaiClient(latency=args.llm_latency, jitter=args.llm_jitter)
+    app_module.get_qcm_generator().gateway.clients = [fake_client]
+    client = app_module.app.test_client()
+
+    texts = [synthetic_text(3, seed=i) for i in range(args.requests)]
+
+    def post(text):
+        start = time.perf_counter()
+        response = client.post('/api/generate', json={
+            'text_content': text,
+            'num_open_questions': args.questions,
+            'num_yes_no_questions': args.questions,
+            'use_cache': False
+        })
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(post, texts))
+    wall = time.perf_counter() - start
+
+    result = summarize([seconds for _, seconds in outcomes], wall_seconds=wall)
+    result['concurrency'] = args.concurrency
+    result['errors'] = sum(1 for status, _ in outcomes if status != 200)
+    result['llm_calls'] = fake_client.models.calls
+    result['llm_gateway'] = app_module.get_qcm_generator().gateway.stats()
+    return result
+
+
+SCENARIOS = {
+    'ingest': bench_ingest,
+    'extract': bench_extract,
+    'chunking': bench_chunking,
+    'retrieval': bench_retrieval,
+    'prompt': bench_prompt,
+    'api': bench_api,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20, help='pages per synthetic PDF')
+    parser.add_argument('--questions', type=int, default=5, help='questions per type')
+    parser.add_argument('--requests', type=int, default=20, help='API requests in the load scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='fake LLM latency in seconds')
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--output', help='write the JSON report to this file as well')
+    args = parser.parse_args()
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.time()
+        },
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('scenarios', 'output')},
+        'scenarios': {}
+    }
+
+    # All stores (./chroma_db, caches, ...) live in a throwaway directory
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="qcm-bench-") as workdir:
+        args.workdir = workdir
+        os.chdir(workdir)
+        try:
+            for name in args.scenarios:
+                print(f"Running {name} benchmark...", file=sys.stderr)
+                report['scenarios'][name] = SCENARIOS[name](args)
+        finally:
+            os.chdir(original_directory)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
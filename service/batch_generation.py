@@ -0,0 +1,207 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+from .document_session import DocumentSession
+from .llm_gimi import QCMGenerator
+from .metrics import metrics
+from .upload_store import UploadStore
+
+
+class BatchItemError(ValueError):
+    """Invalid batch item, reported for that item only"""
+
+
+class BatchGenerator:
+    """
+    Question generation for many documents in one call. Items are texts,
+    uploaded PDFs (saved beforehand) or already indexed document ids, each
+    with its own question counts. Ingestion and generation run on a shared
+    pool: all the texts of a batch are split and embedded together, PDFs are
+    ingested concurrently, and every item moves on to generation as soon as
+    its document is ready. LLM calls of all items go through the generator's
+    gateway, i.e. the process-wide concurrency and rate budget. Results are
+    yielded per item as they complete, a failing item never fails the batch.
+    An item is 'success' when every question type is complete, 'partial'
+    when some questions are missing and 'error' without any question.
+    With an upload_store, an uploaded PDF is pinned in it while it is ingested
+    """
+
+    def __init__(self, qcm_generator: QCMGenerator, max_workers: Optional[int] = None, max_items: Optional[int] = None,
+                 upload_store: Optional[UploadStore] = None):
+        self.qcm_generator = qcm_generator
+        self.upload_store = upload_store
+        self.rag_service = qcm_generator.rag_service
+        self.max_items = max_items or int(os.environ.get("BATCH_MAX_ITEMS", 100))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or int(os.environ.get("BATCH_MAX_WORKERS", 4)),
+                                           thread_name_prefix="qcm-bulk")
+
+    def validate(self, items: List[Dict], defaults: Optional[Dict] = None,
+                 files: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        Normalize the items of a batch: question counts default to the ones
+        of defaults, each item gets an id (its position unless given) and an
+        'error' instead of raising when it is invalid. An item's 'file' names
+        an upload of files ({field: {'path', 'filename', 'document_id'}}, stored beforehand)
+        """
+        if not isinstance(items, list) or not items:
+            raise BatchItemError("items must be a non-empty list")
+        if len(items) > self.max_items:
+            raise BatchItemError(f"At most {self.max_items} items per batch")
+        defaults = defaults or {}
+        files = files or {}
+
+        normalized = []
+        for index, item in enumerate(items):
+            entry = {'index': index, 'id': index}
+            try:
+                if not isinstance(item, dict):
+                    raise BatchItemError("Item must be an object")
+                entry['id'] = item.get('id', index)
+                entry['num_open_questions'] = int(item.get('num_open_questions', defaults.get('num_open_questions', 0)))
+                entry['num_yes_no_questions'] = int(item.get('num_yes_no_questions', defaults.get('num_yes_no_questions', 0)))
+                if entry['num_open_questions'] <= 0 and entry['num_yes_no_questions'] <= 0:
+                    raise BatchItemError("At least one type of question must be requested")
+
+                sources = [key for key in ('text_content', 'file', 'document_id') if item.get(key)]
+                if len(sources) != 1:
+                    raise BatchItemError("Item needs exactly one of text_content, file or document_id")
+                if sources[0] == 'file':
+                    upload = files.get(str(item['file']))
+                    if upload is None:
+                        raise BatchItemError(f"No uploaded file named {item['file']}")
+                    entry['pdf_path'] = upload['path']
+                    entry['pdf_hash'] = upload.get('document_id')
+                    entry['filename'] = upload['filename']
+                else:
+                    entry[sources[0]] = str(item[sources[0]])
+            except (BatchItemError, TypeError, ValueError) as e:
+                entry['error'] = str(e)
+            normalized.append(entry)
+        return normalized
+
+    def run(self, items: List[Dict], use_cache: bool = True) -> Iterator[Dict]:
+        """Process validated items, yields one result per item in completion order"""
+        start = time.monotonic()
+        pending = {}
+
+        texts = [item for item in items if 'error' not in item and 'text_content' in item]
+        if texts:
+            pending[metrics.submit(self.executor, self._prepare_texts, texts)] = ('prepare', None)
+        for item in items:
+            if 'error' in item:
+                yield self._error(item, item['error'])
+            elif 'text_content' not in item:
+                pending[metrics.submit(self.executor, self._prepare_document, item)] = ('prepare', None)
+
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, _ = pending.pop(future)
+                    if stage == 'generate':
+                        yield future.result()
+                        continue
+                    # Generation starts per document, without waiting for the rest of the batch
+                    for item, session, error in future.result():
+                        if error is not None:
+                            yield self._error(item, error)
+                        else:
+                            generation = metrics.submit(self.executor, self._generate, item, session, use_cache)
+                            pending[generation] = ('generate', session)
+        finally:
+            # Client gone: drop what has not started yet, and free the
+            # sessions of documents that were prepared or being prepared
+            # (a started generation closes its own session)
+            for future, (stage, session) in pending.items():
+                if future.cancel():
+                    if session is not None:
+                        session.close()
+                elif stage == 'prepare':
+                    future.add_done_callback(self._close_prepared)
+            metrics.observe("qcm_batch_duration_seconds", time.monotonic() - start)
+
+    def _prepare_texts(self, items: List[Dict]) -> List:
+        """Sessions on the texts of a batch, embedded together; returns (item, session, error) triples"""
+        try:
+            sessions = self.rag_service.process_texts([item['text_content'] for item in items])
+            return [(item, session, None) for item, session in zip(items, sessions)]
+        except Exception as e:
+            print(f"Batch text ingestion failed ({e}), processing texts one by one")
+        return [self._prepare_document(item)[0] for item in items]
+
+    def _prepare_document(self, item: Dict) -> List:
+        """Session on the document of one item, as a single (item, session, error) triple"""
+        try:
+            if 'text_content' in item:
+                session = self.rag_service.process_text(item['text_content'])
+            elif 'pdf_path' in item:
+                if self.upload_store is not None:
+                    self.upload_store.pin(item['pdf_path'])
+                try:
+                    session = self.rag_service.process_pdf(item['pdf_path'], document_id=item.get('pdf_hash'),
+                                                           filename=item.get('filename'))
+                finally:
+                    if self.upload_store is not None:
+                        self.upload_store.unpin(item['pdf_path'])
+            else:
+                session = self.rag_service.load_document(item['document_id'])
+                if session is None:
+                    return [(item, None, f"Unknown or expired document_id: {item['document_id']}")]
+            return [(item, session, None)]
+        except Exception as e:
+            return [(item, None, f"Error processing document: {str(e)}")]
+
+    @staticmethod
+    def _close_prepared(future) -> None:
+        for _, session, _ in future.result():
+            if session is not None:
+                session.close()
+
+    def _generate(self, item: Dict, session: DocumentSession, use_cache: bool) -> Dict:
+        generation_metadata = {}
+        try:
+            questions = self.qcm_generator.generate_questions_from_text(
+                text_content="",
+                num_open_questions=item['num_open_questions'],
+                num_yes_no_questions=item['num_yes_no_questions'],
+                use_cache=use_cache,
+                generation_metadata=generation_metadata,
+                session=session
+            )
+        except Exception as e:
+            return self._error(item, f"Erreur lors de la génération des questions: {str(e)}")
+        finally:
+            # Frees the in-memory index of a text, no-op for indexed documents
+            session.close()
+
+        # Generation reports failures and timeouts per question type instead of raising
+        generation_status = generation_metadata.get('status', {})
+        if not questions:
+            outcome = ", ".join(f"{question_type}: {status['status']}" for question_type, status in generation_status.items())
+            return self._error(item, f"Aucune question générée ({outcome or 'erreur'})")
+        status = QCMGenerator.generation_outcome(generation_status, len(questions))
+
+        metrics.inc("qcm_batch_items_total", labels={'status': status})
+        return {
+            'index': item['index'],
+            'id': item['id'],
+            'status': status,
+            'questions': questions,
+            'metadata': {
+                'total_questions': len(questions),
+                'open_questions': item['num_open_questions'],
+                'yes_no_questions': item['num_yes_no_questions'],
+                'filename': item.get('filename') or session.metadata.get('filename'),
+                'document_id': session.document_id,
+                'index': session.index,
+                'cache': generation_metadata.get('cache', {}),
+                'generation_status': generation_status
+            }
+        }
+
+    @staticmethod
+    def _error(item: Dict, error: str) -> Dict:
+        metrics.inc("qcm_batch_items_total", labels={'status': 'error'})
+        return {'index': item['index'], 'id': item['id'], 'status': 'error', 'error': error}
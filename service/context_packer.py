@@ -0,0 +1,126 @@
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+# Context budget (in estimated tokens) per model; the prompt instructions
+# and the generated answer come on top of it
+DEFAULT_MODEL_BUDGETS = {
+    "gemini-2.0-flash": 8000,
+    "gemini-2.0-flash-lite": 6000,
+    "gemini-1.5-flash": 8000,
+    "gemini-1.5-pro": 16000,
+}
+
+
+class ContextPacker:
+    """
+    Packs retrieved chunks into prompt context: chunks are put back in
+    document order, the overlap the splitter repeats between neighbouring
+    chunks is removed, contiguous chunks of the same page are merged into a
+    single block, and the result is cut to the model's token budget
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, default_budget: Optional[int] = None,
+                 model_budgets: Optional[Dict[str, int]] = None, min_overlap: int = 20, max_overlap: int = 400):
+        self.chars_per_token = chars_per_token
+        self.default_budget = default_budget or int(os.environ.get("PROMPT_CONTEXT_TOKENS", 8000))
+        self.model_budgets = dict(DEFAULT_MODEL_BUDGETS if model_budgets is None else model_budgets)
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def budget_for(self, model: str) -> int:
+        return self.model_budgets.get(model, self.default_budget)
+
+    def pack(self, documents: List[Document], model: str, budget: Optional[int] = None) -> Tuple[List[str], Dict]:
+        """Returns (context blocks, packing statistics)"""
+        budget = budget or self.budget_for(model)
+        original_tokens = sum(self.estimate_tokens(doc.page_content) for doc in documents)
+
+        blocks = self._merge(self._document_order(documents))
+        packed, truncated = self._fit(blocks, budget)
+
+        packed_tokens = sum(self.estimate_tokens(block) for block in packed)
+        return packed, {
+            'chunks': len(documents),
+            'blocks': len(packed),
+            'budget_tokens': budget,
+            'original_tokens': original_tokens,
+            'packed_tokens': packed_tokens,
+            'saved_tokens': original_tokens - packed_tokens,
+            'truncated': truncated
+        }
+
+    @staticmethod
+    def _document_order(documents: List[Document]) -> List[Document]:
+        # Chunks without position metadata keep their retrieval order
+        def position(indexed):
+            index, doc = indexed
+            metadata = doc.metadata or {}
+            start = metadata.get('start_index', -1)
+            return (metadata.get('page', 0), start if start >= 0 else index)
+        return [doc for _, doc in sorted(enumerate(documents), key=position)]
+
+    def _join(self, previous: Document, current: Document) -> Optional[str]:
+        """Text current adds to previous when they are contiguous chunks of the
+        same page (without the repeated overlap), None if they are not"""
+        previous_meta, current_meta = previous.metadata or {}, current.metadata or {}
+        if previous_meta.get('page') != current_meta.get('page'):
+            return None
+        previous_text, current_text = previous.page_content, current.page_content
+
+        # Exact when the splitter recorded start offsets (-1: chunk not found in its page)
+        if previous_meta.get('start_index', -1) >= 0 and current_meta.get('start_index', -1) >= 0:
+            overlap = previous_meta['start_index'] + len(previous_text) - current_meta['start_index']
+            if overlap >= len(current_text):
+                # Only dropped when the previous chunk really contains it
+                return "" if current_text in previous_text else None
+            if overlap > 0 and previous_text.endswith(current_text[:overlap]):
+                return current_text[overlap:]
+            if -2 <= overlap <= 0:
+                return " " + current_text
+            return None
+
+        # Otherwise, look for the longest suffix/prefix match
+        if current_text in previous_text:
+            return ""
+        longest = min(self.max_overlap, len(previous_text), len(current_text))
+        for size in range(longest, self.min_overlap - 1, -1):
+            if previous_text.endswith(current_text[:size]):
+                return current_text[size:]
+        return None
+
+    def _merge(self, documents: List[Document]) -> List[str]:
+        blocks = []
+        previous = None
+        for doc in documents:
+            if not doc.page_content.strip():
+                continue
+            addition = self._join(previous, doc) if previous is not None else None
+            if addition is not None:
+                # Contiguous chunk of the same page: extend the current block
+                blocks[-1] = (blocks[-1] + addition).strip()
+            elif doc.page_content.strip() not in blocks:
+                blocks.append(doc.page_content.strip())
+            previous = doc
+        return blocks
+
+    def _fit(self, blocks: List[str], budget: int) -> Tuple[List[str], bool]:
+        packed = []
+        remaining = budget
+        for block in blocks:
+            tokens = self.estimate_tokens(block)
+            if tokens <= remaining:
+                packed.append(block)
+                remaining -= tokens
+                continue
+            # Keep the head of the block that still fits, cut on a word boundary
+            max_chars = int(remaining * self.chars_per_token)
+            if max_chars >= 200:
+                packed.append(block[:max_chars].rsplit(" ", 1)[0])
+            return packed, True
+        return packed, False
@@ -0,0 +1,140 @@
+import hashlib
+import re
+from collections import Counter
+from typing import List, Optional, Sequence, Set
+
+import numpy as np
+from langchain_core.documents import Document
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_DIGITS = re.compile(r"\d+")
+
+
+def _normalize_line(line: str) -> str:
+    # Page numbers and dates change from page to page, the boilerplate around them doesn't
+    return _DIGITS.sub("#", " ".join(line.split()).lower())
+
+
+# Boilerplate is detected on the first pages of a document only, so that
+# whole-file and windowed ingestion strip the same lines from every page
+BOILERPLATE_SAMPLE_PAGES = 16
+
+
+def _edge_indexes(lines: List[str], edge_lines: int) -> List[int]:
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return non_empty[:edge_lines] + non_empty[-edge_lines:]
+
+
+def detect_headers_footers(pages: List[Document], edge_lines: int = 2, min_pages: int = 3,
+                           min_ratio: float = 0.5) -> Set[str]:
+    """
+    Normalized lines repeated at the top or bottom of many pages (running
+    headers, footers, page numbers): those appearing within the first or
+    last edge_lines lines of at least max(min_pages, min_ratio * len(pages))
+    pages
+    """
+    if len(pages) < min_pages:
+        return set()
+
+    counts = Counter()
+    for doc in pages:
+        lines = doc.page_content.splitlines()
+        counts.update({_normalize_line(lines[i]) for i in _edge_indexes(lines, edge_lines)})
+    threshold = max(min_pages, min_ratio * len(pages))
+    return {line for line, count in counts.items() if count >= threshold and line}
+
+
+def strip_headers_footers(pages: List[Document], boilerplate: Optional[Set[str]] = None,
+                          edge_lines: int = 2) -> List[Document]:
+    """
+    Remove the boilerplate lines (detected on pages unless given) found
+    within the first or last edge_lines lines of each page. A page is never
+    stripped down to nothing
+    """
+    if boilerplate is None:
+        boilerplate = detect_headers_footers(pages, edge_lines)
+    if not boilerplate:
+        return pages
+
+    stripped = []
+    for doc in pages:
+        lines = doc.page_content.splitlines()
+        edge_indexes = set(_edge_indexes(lines, edge_lines))
+        kept = [line for i, line in enumerate(lines)
+                if not (i in edge_indexes and _normalize_line(line) in boilerplate)]
+        content = "\n".join(kept) if any(line.strip() for line in kept) else doc.page_content
+        stripped.append(Document(page_content=content, metadata=doc.metadata))
+    return stripped
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash of the word shingles of a text"""
+    words = _WORD.findall(text.lower())
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    counts = Counter(shingles)
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in counts],
+        dtype=np.uint64
+    )
+    # Each shingle votes +count / -count on every bit, by the bits of its hash
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    weights = ((bits.astype(np.int64) * 2 - 1) * np.array(list(counts.values()), dtype=np.int64)[:, None]).sum(axis=0)
+    return sum(1 << int(bit) for bit in np.flatnonzero(weights > 0))
+
+
+class NearDuplicateFilter:
+    """
+    Drops chunks whose SimHash is within max_distance bits of a chunk seen
+    before. Fingerprints are bucketed by 16-bit bands: two fingerprints
+    that differ by at most 3 bits share at least one of the 4 bands, so only
+    same-bucket candidates are compared (hence max_distance <= 3)
+    """
+
+    BANDS = 4
+
+    def __init__(self, max_distance: int = 3):
+        if not 0 <= max_distance < self.BANDS:
+            raise ValueError(f"max_distance must be between 0 and {self.BANDS - 1}")
+        self.max_distance = max_distance
+        self._buckets = [dict() for _ in range(self.BANDS)]
+        self.seen = 0
+        self.dropped = 0
+
+    def _bands(self, fingerprint: int):
+        return [(fingerprint >> (16 * band)) & 0xFFFF for band in range(self.BANDS)]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Check a chunk against the ones seen so far, and remember it if it is new"""
+        fingerprint = simhash(text)
+        bands = self._bands(fingerprint)
+        for band, key in enumerate(bands):
+            for other in self._buckets[band].get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    self.dropped += 1
+                    return True
+        for band, key in enumerate(bands):
+            self._buckets[band].setdefault(key, []).append(fingerprint)
+        self.seen += 1
+        return False
+
+    def filter(self, chunks: List[Document]) -> List[Document]:
+        return [chunk for chunk in chunks if not self.is_duplicate(chunk.page_content)]
+
+
+def semantic_unique(vectors: Sequence[Sequence[float]], threshold: float) -> List[int]:
+    """
+    Indexes of the items to keep, in order: an item is dropped when its
+    cosine similarity with an earlier kept item reaches threshold
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if len(matrix) == 0:
+        return []
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.maximum(norms, 1e-12)
+    similarities = matrix @ matrix.T
+
+    kept = []
+    for i in range(len(matrix)):
+        if not kept or similarities[i, kept].max() < threshold:
+            kept.append(i)
+    return kept
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, List, Optional
+
+
+@contextmanager
+def _always_locked(document_id: str):
+    yield True
+
+
+class DocumentRegistry:
+    """
+    Registry of indexed documents, each one stored in its own persistent
+    Chroma collection. The TTL runs from the first registration of a
+    document (re-registering it while it is ingested does not extend it).
+    Expiry and eviction only drop a document that has no session open in
+    any process sharing the registry (see pin) and whose
+    lock_document(document_id) lock can be taken without waiting; others
+    are kept until a later pass
+    """
+
+    def __init__(self, chroma_client, registry_path: str = "./chroma_db/document_registry.sqlite",
+                 max_documents: int = 50, ttl_seconds: float = 7 * 24 * 3600,
+                 max_disk_bytes: int = 1024 ** 3, stale_ingest_seconds: float = 3600,
+                 lock_document: Optional[Callable[[str], ContextManager[bool]]] = None,
+                 pin_lease_seconds: float = 3600):
+        os.makedirs(os.path.dirname(registry_path) or ".", exist_ok=True)
+        self.chroma_client = chroma_client
+        # Non-blocking per-document lock, yields whether it was acquired
+        self.lock_document = lock_document or _always_locked
+        # Pins are leases in the shared sqlite file, so sessions open in other
+        # worker processes count too; one left by a crashed process lapses
+        # after that long
+        self.pin_lease_seconds = pin_lease_seconds
+        self.max_documents = max_documents
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        # Entries being ingested are re-registered after every window; one
+        # not updated for that long was left by a crashed writer
+        self.stale_ingest_seconds = stale_ingest_seconds
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(registry_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " document_id TEXT PRIMARY KEY,"
+            " collection_name TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " size_bytes INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pins ("
+            " lease_id TEXT PRIMARY KEY,"
+            " document_id TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pins_document_id ON pins (document_id)")
+        self._conn.commit()
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """Compute the content hash used as document id for a file"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Compute the content hash used as document id for raw text"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def collection_name(document_id: str) -> str:
+        """Name of the Chroma collection holding a document"""
+        return f"doc_{document_id[:32]}"
+
+    def get(self, document_id: str, pin: bool = False) -> Optional[Dict]:
+        """Look up a document and mark it as recently used; with pin, the
+        document is pinned (see pin) in the same step and the entry's
+        'lease' is the id to unpin it with"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT collection_name, metadata, size_bytes, created_at, last_access FROM documents WHERE document_id = ?",
+                (document_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if (time.time() - row[3] > self.ttl_seconds and not self._ingesting(row[1], row[4])
+                    and self._try_drop(document_id, row[0])):
+                self._conn.commit()
+                return None
+            lease = self._pin(document_id) if pin else None
+            self._conn.execute(
+                "UPDATE documents SET last_access = ? WHERE document_id = ?",
+                (time.time(), document_id)
+            )
+            self._conn.commit()
+        entry = {
+            'document_id': document_id,
+            'collection_name': row[0],
+            'metadata': json.loads(row[1]),
+            'size_bytes': row[2]
+        }
+        if lease is not None:
+            entry['lease'] = lease
+        return entry
+
+    def pin(self, document_id: str) -> str:
+        """Mark a session open on document_id: it is not dropped until the
+        returned lease is passed to unpin (or lapses, see pin_lease_seconds)"""
+        with self._lock:
+            lease = self._pin(document_id)
+            self._conn.commit()
+        return lease
+
+    def unpin(self, lease: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM pins WHERE lease_id = ?", (lease,))
+            self._conn.commit()
+
+    def _pin(self, document_id: str) -> str:
+        lease = uuid.uuid4().hex
+        self._conn.execute(
+            "INSERT INTO pins (lease_id, document_id, expires_at) VALUES (?, ?, ?)",
+            (lease, document_id, time.time() + self.pin_lease_seconds)
+        )
+        return lease
+
+    def _pinned(self, document_id: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM pins WHERE document_id = ? AND expires_at > ? LIMIT 1",
+            (document_id, time.time())
+        ).fetchone() is not None
+
+    def register(self, document_id: str, metadata: Dict, size_bytes: int) -> None:
+        """Record a freshly indexed document and evict old ones if over budget;
+        an already registered document keeps its created_at"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO documents"
+                " (document_id, collection_name, metadata, size_bytes, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (document_id) DO UPDATE SET collection_name = excluded.collection_name,"
+                " metadata = excluded.metadata, size_bytes = excluded.size_bytes, last_access = excluded.last_access",
+                (document_id, self.collection_name(document_id), json.dumps(metadata), size_bytes, now, now)
+            )
+            self._evict(keep=document_id)
+            self._conn.commit()
+
+    def remove(self, document_id: str) -> None:
+        """Drop a document and its collection; the caller holds the document's lock"""
+        with self._lock:
+            self._drop(document_id, self.collection_name(document_id))
+            self._conn.commit()
+
+    def list_documents(self) -> List[Dict]:
+        """List registered documents, most recently used first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document_id, metadata, size_bytes, last_access FROM documents ORDER BY last_access DESC"
+            ).fetchall()
+        return [
+            {'document_id': row[0], 'metadata': json.loads(row[1]), 'size_bytes': row[2], 'last_access': row[3]}
+            for row in rows
+        ]
+
+    def drop_collection(self, collection_name: str) -> None:
+        """Delete a Chroma collection, ignoring collections that do not exist"""
+        try:
+            self.chroma_client.delete_collection(collection_name)
+        except Exception as e:
+            print(f"Warning: Error deleting collection {collection_name}: {e}")
+
+    def drop_orphan_collection(self, document_id: str) -> bool:
+        """Delete the collection of an unregistered document, left behind by a
+        writer that crashed before registering it; returns whether one existed"""
+        collection_name = self.collection_name(document_id)
+        try:
+            self.chroma_client.get_collection(collection_name)
+        except Exception:
+            return False
+        self.drop_collection(collection_name)
+        return True
+
+    def _drop(self, document_id: str, collection_name: str) -> None:
+        self.drop_collection(collection_name)
+        self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+        print(f"Evicted document {document_id[:12]} ({collection_name})")
+
+    def _try_drop(self, document_id: str, collection_name: str) -> bool:
+        """Drop a document unless a session is open on it or its lock is taken"""
+        if self._pinned(document_id):
+            return False
+        with self.lock_document(document_id) as locked:
+            if locked:
+                self._drop(document_id, collection_name)
+            return locked
+
+    def _ingesting(self, metadata: str, last_access: float) -> bool:
+        # A document still being written is never evicted under its writer
+        return (json.loads(metadata).get('status', 'done') == 'ingesting'
+                and time.time() - last_access < self.stale_ingest_seconds)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        # Expired documents go first, then least recently used ones until the
+        # document count and disk budget are respected
+        self._conn.execute("DELETE FROM pins WHERE expires_at <= ?", (time.time(),))
+        rows = self._conn.execute(
+            "SELECT document_id, collection_name, size_bytes, created_at, metadata, last_access"
+            " FROM documents ORDER BY last_access ASC"
+        ).fetchall()
+        now = time.time()
+        remaining = []
+        for row in rows:
+            if (row[0] != keep and now - row[3] > self.ttl_seconds and not self._ingesting(row[4], row[5])
+                    and self._try_drop(row[0], row[1])):
+                continue
+            remaining.append(row)
+
+        total_bytes = sum(row[2] for row in remaining)
+        count = len(remaining)
+        for document_id, collection_name, size_bytes, _, metadata, last_access in remaining:
+            if count <= self.max_documents and total_bytes <= self.max_disk_bytes:
+                break
+            if document_id == keep or self._ingesting(metadata, last_access):
+                continue
+            if not self._try_drop(document_id, collection_name):
+                continue
+            count -= 1
+            total_bytes -= size_bytes
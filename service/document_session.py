@@ -0,0 +1,84 @@
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Dict, Mapping, Optional, Sequence
+
+from langchain_core.documents import Document
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+
+
+class _Holds:
+    """Number of holders of a session, the last one to close it releases it"""
+
+    def __init__(self):
+        self.count = 1
+        self.lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class DocumentSession:
+    """
+    Immutable, request-scoped handle on one indexed document: its id, a
+    snapshot of its metadata and a view over its collection in the shared
+    Chroma client. Sessions are created per request by RAGService and passed
+    explicitly, so concurrent requests never see each other's document.
+    
+    Small raw texts have no vector store at all, their documents go to the
+    prompt as-is; one-off texts are indexed in memory and release() frees
+    that index at the end of the request. Work that may outlive its caller
+    (generation branches past the request deadline) holds the session, and
+    it is only released once every holder has closed it
+    """
+
+    document_id: str
+    metadata: Mapping
+    vector_store: Optional["Chroma"]
+    documents: Sequence[Document] = ()
+    release: Optional[Callable[[], None]] = None
+    _holds: _Holds = field(default_factory=_Holds, compare=False, repr=False)
+
+    @classmethod
+    def create(cls, document_id: str, metadata: Dict, vector_store: Optional["Chroma"],
+               documents: Sequence[Document] = (), release: Optional[Callable[[], None]] = None) -> "DocumentSession":
+        # Read-only copy: later changes to the registry entry don't leak in
+        return cls(document_id, MappingProxyType(dict(metadata)), vector_store, tuple(documents), release)
+
+    @property
+    def index(self) -> str:
+        """How the document is served: persistent, ephemeral or inline"""
+        return self.metadata.get('index', 'persistent')
+
+    def hold(self) -> "DocumentSession":
+        """Take one more hold on the session, to be given back with close()"""
+        with self._holds.lock:
+            self._holds.count += 1
+        return self
+
+    def close(self) -> None:
+        """Give back a hold; the last one frees the resources held for this
+        request only (ephemeral index, registry pin)"""
+        with self._holds.lock:
+            self._holds.count -= 1
+            last = self._holds.count == 0
+        if last and self.release is not None:
+            self.release()
+
+    def __enter__(self) -> "DocumentSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def stats(self) -> Dict:
+        """Get statistics about the document"""
+        return {
+            'total_chunks': self.metadata.get('total_chunks', 0),
+            'chunk_size': self.metadata.get('chunk_size', 0),
+            'chunk_overlap': self.metadata.get('chunk_overlap', 0),
+            'chunk_unit': self.metadata.get('chunk_unit', 'chars'),
+            'processed_date': self.metadata.get('processed_date', ''),
+            'document_id': self.document_id,
+            'index': self.index
+        }
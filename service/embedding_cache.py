@@ -0,0 +1,67 @@
+import hashlib
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from .sqlite_lru import SqliteLRUCache
+
+
+class EmbeddingCache(SqliteLRUCache):
+    """Persistent, size-bounded LRU cache of embeddings stored in sqlite"""
+
+    table = "embeddings"
+    value_column = "vector"
+    value_type = "BLOB"
+    metrics_label = "embedding"
+
+    def __init__(self, cache_path: str = "./embedding_cache/embeddings.sqlite", max_entries: int = 200_000):
+        super().__init__(cache_path, max_entries)
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        """Build the cache key for a text embedded under a given namespace"""
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _encode(self, vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    def _decode(self, blob: bytes) -> List[float]:
+        return array("f", blob).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, namespace: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.namespace, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it appears several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = EmbeddingCache.make_key(f"query|{self.namespace}", text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from .rag_service import RAGService, load_and_split_pdf
+from .upload_store import UploadStore
+
+
+class IngestionJob:
+    """
+    State and progress of a PDF ingestion job. Unlike RAGService.process_pdf,
+    the job path is not windowed: a PDF is parsed whole in one worker
+    process, so pages_parsed stays 0 while the job is 'parsing' and is set
+    to the page count once parsing is done; chunks_embedded then grows batch
+    by batch
+    """
+
+    def __init__(self, job_id: str, filename: str, pdf_path: str):
+        self.job_id = job_id
+        self.filename = filename
+        self.pdf_path = pdf_path
+        self.status = 'queued'
+        self.document_id = None
+        self.error = None
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job is done or failed, returns False on timeout"""
+        return self.finished.wait(timeout)
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'filename': self.filename,
+            'document_id': self.document_id,
+            'error': self.error,
+            'progress': {
+                'pages_parsed': self.pages_parsed,
+                'chunks_total': self.chunks_total,
+                'chunks_embedded': self.chunks_embedded
+            },
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class IngestionJobQueue:
+    """
+    Background PDF ingestion: parsing and splitting run on a process pool
+    (one whole PDF per core, see IngestionJob for the progress reported), then a single embedding thread indexes the chunks
+    into the document registry, so request workers never block on ingestion.
+    With an upload_store, the PDF of each job is pinned in it until it is
+    parsed, so the upload cleanup cannot remove it while the job is queued
+    """
+
+    def __init__(self, rag_service: RAGService, max_processes: Optional[int] = None, max_finished_jobs: int = 1000,
+                 upload_store: Optional[UploadStore] = None):
+        self.rag_service = rag_service
+        self.upload_store = upload_store
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}
+        self._lock = threading.Lock()
+        # Workers start from request threads: a forked child could inherit
+        # locks (metrics, resources, sqlite) held by another thread and hang
+        self._process_pool = ProcessPoolExecutor(max_workers=max_processes, mp_context=multiprocessing.get_context("spawn"))
+        self._embed_queue = queue.Queue()
+        self._embed_thread = threading.Thread(target=self._embed_worker, name="ingestion-embed", daemon=True)
+        self._embed_thread.start()
+
+    def submit(self, pdf_path: str, filename: Optional[str] = None, document_id: Optional[str] = None) -> IngestionJob:
+        """Queue a PDF for ingestion and return its job immediately; document_id
+        is the content hash of the file, computed here unless given"""
+        job = IngestionJob(uuid.uuid4().hex, filename or os.path.basename(pdf_path), pdf_path)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._prune_finished_jobs()
+
+        # Already indexed documents finish right away
+        document_id = document_id or self.rag_service.registry.hash_file(pdf_path)
+        if self.rag_service.is_indexed(document_id):
+            self._finish(job, document_id=document_id)
+            return job
+
+        job.document_id = document_id
+        job.status = 'parsing'
+        if self.upload_store is not None:
+            self.upload_store.pin(pdf_path)
+        future = self._process_pool.submit(
+            load_and_split_pdf, pdf_path,
+            self.rag_service.text_splitter._chunk_size, self.rag_service.text_splitter._chunk_overlap,
+            self.rag_service.chunk_dedup, self.rag_service.chunk_tokenizer
+        )
+        future.add_done_callback(lambda f: self._on_parsed(job, f))
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            'jobs': len(statuses),
+            'pending_embedding': self._embed_queue.qsize(),
+            **{status: statuses.count(status) for status in ('parsing', 'queued_for_embedding', 'embedding', 'done', 'failed')}
+        }
+
+    def _on_parsed(self, job: IngestionJob, future) -> None:
+        # The file is not read anymore once parsed
+        if self.upload_store is not None:
+            self.upload_store.unpin(job.pdf_path)
+        try:
+            total_pages, documents = future.result()
+        except Exception as e:
+            self._finish(job, error=f"Error processing PDF: {str(e)}")
+            return
+        job.pages_parsed = total_pages
+        job.chunks_total = len(documents)
+        job.status = 'queued_for_embedding'
+        self._embed_queue.put((job, total_pages, documents))
+
+    def _embed_worker(self) -> None:
+        while True:
+            job, total_pages, documents = self._embed_queue.get()
+            job.status = 'embedding'
+            try:
+                # The same PDF may have been queued twice before either copy
+                # was indexed; embedding runs on this single thread, so the
+                # check below is enough to index it only once
+                if self.rag_service.is_indexed(job.document_id):
+                    self._finish(job, document_id=job.document_id)
+                    continue
+                self.rag_service.index_pdf_documents(
+                    job.document_id, job.filename, total_pages, documents,
+                    progress_callback=lambda embedded: setattr(job, 'chunks_embedded', embedded)
+                ).close()
+                self._finish(job, document_id=job.document_id)
+            except Exception as e:
+                self._finish(job, error=str(e))
+
+    def _finish(self, job: IngestionJob, document_id: Optional[str] = None, error: Optional[str] = None) -> None:
+        if error:
+            job.status = 'failed'
+            job.error = error
+            print(f"Ingestion job {job.job_id} failed: {error}")
+        else:
+            job.status = 'done'
+            job.document_id = document_id
+            job.chunks_embedded = job.chunks_total
+        job.finished_at = time.time()
+        job.finished.set()
+
+    def _prune_finished_jobs(self) -> None:
+        finished = [job for job in self.jobs.values() if job.finished.is_set()]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job.job_id]
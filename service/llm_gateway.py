@@ -0,0 +1,279 @@
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .metrics import metrics
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when a call cannot be started or retried before its deadline"""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most
+    capacity tokens. Reservations may drive it negative: the caller then
+    waits for the debt to be refilled, so waiting callers are served in order
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount tokens, returns the seconds to wait before using them"""
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float, now: float) -> None:
+        """Correct a reservation once the real cost is known (negative refunds)"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class LLMGateway:
+    """
+    Shared entry point for Gemini calls: requests/tokens per minute rate
+    limiting, bounded concurrency, retries with jittered exponential backoff
+    on retryable errors, per-call deadlines and round-robin over several
+    clients (one per API key)
+    """
+
+    def __init__(self, clients: List, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_concurrency: int = 8, max_retries: int = 4,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0, call_timeout: float = 60.0,
+                 chars_per_token: float = 4.0):
+        if not clients:
+            raise ValueError("LLMGateway needs at least one client")
+        self.clients = list(clients)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.call_timeout = call_timeout
+        self.chars_per_token = chars_per_token
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._next_client = 0
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_env(cls, call_timeout: float = 60.0, clients: Optional[List] = None) -> "LLMGateway":
+        """
+        Build the gateway from the environment: GEMINI_API_KEYS (comma
+        separated, round-robin) or GEMINI_API_KEY, and the LLM_* limits
+        """
+        if clients is None:
+            from google import genai
+            from google.genai import types
+
+            keys = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+            if not keys and os.environ.get("GEMINI_API_KEY"):
+                keys = [os.environ["GEMINI_API_KEY"]]
+            if not keys:
+                raise ValueError("GEMINI_API_KEY environment variable is not set")
+            # Per-call HTTP timeout (in ms)
+            clients = [
+                genai.Client(api_key=key, http_options=types.HttpOptions(timeout=int(call_timeout * 1000)))
+                for key in keys
+            ]
+
+        return cls(
+            clients,
+            requests_per_minute=float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 0)) or None,
+            tokens_per_minute=float(os.environ.get("LLM_TOKENS_PER_MINUTE", 0)) or None,
+            max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+            max_retries=int(os.environ.get("LLM_MAX_RETRIES", 4)),
+            call_timeout=call_timeout
+        )
+
+    def estimate_tokens(self, contents) -> int:
+        text = contents if isinstance(contents, str) else str(contents)
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def generate_content(self, model: str, contents, config=None, deadline: Optional[float] = None):
+        """client.models.generate_content through the rate limiter, concurrency bound and retries"""
+        deadline = deadline if deadline is not None else time.monotonic() + self.call_timeout
+        tokens = self.estimate_tokens(contents)
+        attempt = 0
+        while True:
+            client = self._acquire(tokens, deadline)
+            try:
+                response = client.models.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                self._release(tokens, None)
+                attempt = self._before_retry(e, attempt, deadline)
+                continue
+            self._release(tokens, getattr(response, 'usage_metadata', None))
+            return response
+
+    def generate_content_stream(self, model: str, contents, config=None,
+                                deadline: Optional[float] = None) -> Iterator:
+        """
+        client.models.generate_content_stream through the gateway; the
+        concurrency slot is held until the stream is consumed, and errors
+        are only retried before the first chunk was yielded
+        """
+        deadline = deadline if deadline is not None else time.monotonic() + self.call_timeout
+        tokens = self.estimate_tokens(contents)
+        attempt = 0
+        while True:
+            client = self._acquire(tokens, deadline)
+            usage = None
+            started = False
+            try:
+                for chunk in client.models.generate_content_stream(model=model, contents=contents, config=config):
+                    started = True
+                    usage = getattr(chunk, 'usage_metadata', None) or usage
+                    yield chunk
+            except Exception as e:
+                self._release(tokens, usage)
+                if started:
+                    raise
+                attempt = self._before_retry(e, attempt, deadline)
+                continue
+            except BaseException:
+                # Consumer stopped early (GeneratorExit): just free the slot
+                self._release(tokens, usage)
+                raise
+            self._release(tokens, usage)
+            return
+
+    def _acquire(self, tokens: int, deadline: float):
+        """Wait for the rate limits and a concurrency slot, returns the client to use"""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        metrics.gauge_add("qcm_llm_queue_depth", 1)
+        try:
+            with self._lock:
+                now = time.monotonic()
+                wait = 0.0
+                if self._request_bucket:
+                    wait = max(wait, self._request_bucket.reserve(1, now))
+                if self._token_bucket:
+                    wait = max(wait, self._token_bucket.reserve(tokens, now))
+            if now + wait > deadline:
+                self._cancel_reservation(tokens)
+                self._deadline_exceeded("rate limit")
+            if wait > 0:
+                time.sleep(wait)
+
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self._cancel_reservation(tokens)
+                self._deadline_exceeded("concurrency slot")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+            metrics.gauge_add("qcm_llm_queue_depth", -1)
+
+        waited = time.monotonic() - start
+        metrics.observe("qcm_llm_wait_seconds", waited)
+        metrics.gauge_add("qcm_llm_in_flight", 1)
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            client = self.clients[self._next_client % len(self.clients)]
+            self._next_client += 1
+        return client
+
+    def _release(self, tokens: int, usage) -> None:
+        self._slots.release()
+        metrics.gauge_add("qcm_llm_in_flight", -1)
+        with self._lock:
+            self.in_flight -= 1
+            # Charge the tokens actually used instead of the prompt estimate
+            total = getattr(usage, 'total_token_count', None) if usage is not None else None
+            if self._token_bucket and total:
+                self._token_bucket.adjust(total - tokens, time.monotonic())
+
+    def _cancel_reservation(self, tokens: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._request_bucket:
+                self._request_bucket.adjust(-1, now)
+            if self._token_bucket:
+                self._token_bucket.adjust(-tokens, now)
+
+    def _deadline_exceeded(self, waiting_for: str) -> None:
+        with self._lock:
+            self.deadline_exceeded += 1
+        raise LLMDeadlineExceeded(f"LLM call deadline exceeded while waiting for {waiting_for}")
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+        if isinstance(code, int):
+            return code in RETRYABLE_STATUS_CODES
+        # Transport errors (httpx timeouts, dropped connections, ...)
+        return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in type(error).__name__
+
+    def _before_retry(self, error: Exception, attempt: int, deadline: float) -> int:
+        """Re-raise error if it cannot be retried, otherwise sleep the backoff delay"""
+        code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+        with self._lock:
+            if code == 429:
+                self.throttled += 1
+            if not self.is_retryable(error) or attempt >= self.max_retries:
+                self.failures += 1
+                raise error
+
+        # Full jitter keeps concurrent callers from retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if time.monotonic() + delay > deadline:
+            with self._lock:
+                self.failures += 1
+            raise error
+
+        print(f"Retryable LLM error ({code or type(error).__name__}), retrying in {delay:.1f}s")
+        metrics.inc("qcm_llm_retries_total", labels={'code': str(code or type(error).__name__)})
+        with self._lock:
+            self.retries += 1
+        time.sleep(delay)
+        return attempt + 1
+
+    def stats(self) -> Dict:
+        """Queue depth, wait times and retry counters"""
+        with self._lock:
+            return {
+                'clients': len(self.clients),
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'failures': self.failures,
+                'deadline_exceeded': self.deadline_exceeded,
+                'avg_wait_seconds': self.total_wait / self.calls if self.calls else 0.0,
+                'max_wait_seconds': self.max_wait,
+                'requests_per_minute': self._request_bucket.rate * 60 if self._request_bucket else None,
+                'tokens_per_minute': self._token_bucket.rate * 60 if self._token_bucket else None
+            }
@@ -1,58 +1,164 @@
 import json
+import math
 import os
+import queue
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
-from google import genai
 from .rag_service import RAGService
+from .document_session import DocumentSession
+from .result_cache import ResultCache
+from .stream_parser import IncrementalQuestionParser
+from .metrics import metrics
+from .llm_gateway import LLMGateway
+from .context_packer import ContextPacker
+from .dedup import semantic_unique
+from .question_schema import QUESTION_SCHEMAS, parse_question_items, validate_question_items
 
 load_dotenv()
 
+# Bump whenever the prompts or the output post-processing change, so that
+# cached question sets from older prompts are not served anymore
+PROMPT_VERSION = "3"
+
 class QCMGenerator:
-    def __init__(self):
-        # Get API key
-        self.api_key = os.environ.get("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is not set")
+    def __init__(self, request_timeout: float = 60.0, max_workers: int = 8,
+                 questions_per_batch: int = 10, max_batch_concurrency: int = 4, max_batch_retries: int = 2,
+                 structured_output: bool = None, max_parse_retries: int = 2, retry_backoff: float = 1.0,
+                 client=None, rag_service: RAGService = None):
+        self.request_timeout = request_timeout
+        
+        # Structured output: Gemini answers in JSON following the question
+        # schema, items are validated one by one and only the missing
+        # questions are requested again (at most max_parse_retries times)
+        if structured_output is None:
+            structured_output = os.environ.get("STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no", "off")
+        self.structured_output = structured_output
+        self.max_parse_retries = max_parse_retries
+        self.retry_backoff = retry_backoff
+        
+        # Every Gemini call goes through the gateway (rate limits, retries,
+        # concurrency bound); client injects a stand-in exposing
+        # models.generate_content(_stream) instead of the Gemini clients
+        self.gateway = LLMGateway.from_env(request_timeout, clients=[client] if client is not None else None)
+        
+        # Shared pool running the generation branches of a request concurrently
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qcm")
         
-        # Initialize the Gemini client
-        self.client = genai.Client(api_key=self.api_key)
+        # Large question counts are fanned out in groups of at most
+        # questions_per_batch, on a separate pool bounding their concurrency
+        self.questions_per_batch = questions_per_batch
+        self.max_batch_retries = max_batch_retries
+        self.batch_executor = ThreadPoolExecutor(max_workers=max_batch_concurrency, thread_name_prefix="qcm-batch")
+        
+        # Generated questions at least this similar (cosine, question
+        # embeddings) to an earlier one are dropped as duplicates
+        self.question_dedup_threshold = float(os.environ.get("QUESTION_DEDUP_THRESHOLD", 0.9))
+        
+        # Packs retrieved chunks into a deduplicated, budgeted prompt context
+        self.context_packer = ContextPacker()
+        
+        # Generated question sets, reused across requests for the same document
+        self.result_cache = ResultCache.from_env()
         
         # Initialize RAG service
-        self.rag_service = RAGService()
+        self.rag_service = rag_service if rag_service is not None else RAGService()
     
-    def process_document(self, text_content: str, metadata: dict = None) -> None:
-        """Process a document and prepare it for question generation"""
-        self.rag_service.process_text(text_content)
+    def process_document(self, text_content: str, metadata: dict = None) -> DocumentSession:
+        """Process a document and return the session to generate questions from"""
+        session = self.rag_service.process_text(text_content)
         if metadata:
             self.rag_service.save_metadata(metadata)
+        return session
+    
+    def _cache_key(self, session, question_type, num_questions, model):
+        # The retrieval strategy changes the context, hence the questions
+        prompt_version = f"{PROMPT_VERSION}:{self.rag_service.retrieval_strategy}"
+        return ResultCache.make_key(session.document_id, question_type, num_questions, model, prompt_version)
     
-    def generate_questions_from_text(self, text_content, num_open_questions=0, num_yes_no_questions=0, model="gemini-2.0-flash"):
+    @staticmethod
+    def _cacheable(session):
+        # Questions drawn from the first windows of a document still being
+        # ingested must not be served once the whole document is indexed
+        return session.metadata.get('status', 'done') == 'done'
+    
+    def generate_questions_from_text(self, text_content, num_open_questions=0, num_yes_no_questions=0, model="gemini-2.0-flash",
+                                     use_cache=True, generation_metadata=None, session: DocumentSession = None):
         """
-        Generate both open-ended questions and yes/no questions from text using the Google Gemini API
+        Generate both open-ended questions and yes/no questions from text using the Google Gemini API.
+        
+        Questions are generated from session (an already indexed document)
+        or, without one, from text_content, which is indexed first. Question
+        sets are served from the result cache unless use_cache is False; if a
+        generation_metadata dict is given, it is filled with details about
+        how the questions were produced (cache hits, context packing,
+        per-type status, ...)
         """
         results = []
+        if generation_metadata is None:
+            generation_metadata = {}
+        generation_metadata['cache'] = {}
+        generation_metadata['context'] = {}
+        generation_metadata['status'] = {}
+        # A session built here from text_content belongs to this call only
+        owned_session = None
         
         try:
-            # Process the document if not already processed
-            if not self.rag_service.vector_store:
-                self.process_document(text_content)
+            # Every request works on its own session, never on another request's document
+            if session is None:
+                session = owned_session = self.process_document(text_content)
+            generation_metadata['index'] = session.index
             
-            # Generate open-ended questions if requested
+            branches = []
             if num_open_questions > 0:
-                # Get relevant context for open questions
-                context_chunks = self.rag_service.get_context_for_question("open", num_open_questions)
-                open_questions = self._generate_open_questions(context_chunks, num_open_questions, model)
-                for question in open_questions:
-                    question['type'] = 'open'
-                results.extend(open_questions)
-            
-            # Generate yes/no questions if requested
+                branches.append(('open', num_open_questions))
             if num_yes_no_questions > 0:
-                # Get relevant context for yes/no questions
-                context_chunks = self.rag_service.get_context_for_question("yes_no", num_yes_no_questions)
-                yes_no_questions = self._generate_yes_no_questions(context_chunks, num_yes_no_questions, model)
-                for question in yes_no_questions:
-                    question['type'] = 'yes_no'
-                results.extend(yes_no_questions)
+                branches.append(('yes_no', num_yes_no_questions))
+            
+            # Run the requested question types concurrently, each one doing
+            # its own retrieval and LLM call, unless it is already cached.
+            # Branches stop by themselves at the request deadline
+            deadline = time.monotonic() + self.request_timeout
+            futures = []
+            for question_type, num_questions in branches:
+                cache_key = self._cache_key(session, question_type, num_questions, model)
+                cached = self.result_cache.get(cache_key) if use_cache else None
+                generation_metadata['cache'][question_type] = 'hit' if cached is not None else ('miss' if use_cache else 'bypass')
+                if cached is not None:
+                    generation_metadata['status'][question_type] = self._generation_status(num_questions, len(cached))
+                    futures.append((question_type, cache_key, None, cached))
+                else:
+                    future = metrics.submit(self.executor, self._generate_questions_for_type, session, question_type, num_questions,
+                                            model, deadline)
+                    self._hold_until_done(session, future)
+                    futures.append((question_type, cache_key, future, None))
+            
+            # Collect in a stable order (open, then yes/no); a branch that
+            # misses the deadline is dropped without blocking the other one.
+            # Only this thread writes generation_metadata, so a branch that
+            # finishes late cannot touch a request that already returned
+            for (question_type, cache_key, future, cached), (_, num_questions) in zip(futures, branches):
+                if cached is not None:
+                    results.extend(cached)
+                    continue
+                try:
+                    questions, context_stats = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                    generation_metadata['context'][question_type] = context_stats
+                    generation_metadata['status'][question_type] = self._generation_status(num_questions, len(questions))
+                    # Only complete sets of fully ingested documents are
+                    # cached, a partial one is retried next time
+                    if (generation_metadata['status'][question_type]['status'] == 'complete'
+                            and self._cacheable(session)):
+                        self.result_cache.set(cache_key, questions)
+                    results.extend(questions)
+                except FuturesTimeoutError:
+                    future.cancel()
+                    generation_metadata['status'][question_type] = self._generation_status(num_questions, 0, 'timeout')
+                    print(f"Timed out generating {question_type} questions after {self.request_timeout}s")
+                except Exception as e:
+                    generation_metadata['status'][question_type] = self._generation_status(num_questions, 0, 'failed')
+                    print(f"Error generating {question_type} questions: {e}")
                 
             return results
         
@@ -61,52 +167,449 @@ class QCMGenerator:
             import traceback
             traceback.print_exc()
             return []
+        finally:
+            # Branches still running keep their own hold on the session
+            if owned_session is not None:
+                owned_session.close()
     
-    def _generate_open_questions(self, context_chunks, num_questions, model):
+    @staticmethod
+    def _hold_until_done(session, future):
         """
-        Generate open-ended questions with reference answers
+        Keep session open until future has finished, even when the request gave up on it
+        """
+        session.hold()
+        future.add_done_callback(lambda _: session.close())
+    
+    def stream_questions_from_text(self, text_content, num_open_questions=0, num_yes_no_questions=0, model="gemini-2.0-flash",
+                                   use_cache=True, session: DocumentSession = None, generation_metadata=None):
         """
+        Generate questions like generate_questions_from_text, yielding each
+        question as soon as it is parsed from the streamed Gemini response.
+        Once the stream ends, generation_metadata holds the per-type status
+        and, for failed types, the error ('errors')
+        """
+        if generation_metadata is None:
+            generation_metadata = {}
+        generation_metadata['cache'] = {}
+        generation_metadata['status'] = {}
+        generation_metadata['errors'] = {}
+        if session is not None:
+            yield from self._stream_questions(session, num_open_questions, num_yes_no_questions, model, use_cache,
+                                              generation_metadata)
+            return
+        # Built from text_content for this stream only, freed once it ends
+        with self.process_document(text_content) as session:
+            yield from self._stream_questions(session, num_open_questions, num_yes_no_questions, model, use_cache,
+                                              generation_metadata)
+    
+    def _stream_questions(self, session, num_open_questions, num_yes_no_questions, model, use_cache, generation_metadata):
+        """
+        Run the streaming branches of one session and yield their questions
+        """
+        branches = []
+        if num_open_questions > 0:
+            branches.append(('open', num_open_questions))
+        if num_yes_no_questions > 0:
+            branches.append(('yes_no', num_yes_no_questions))
+        
+        # Both branches stream concurrently into a shared queue; a
+        # (question_type, error) tuple marks the end of a branch. Branches
+        # stop by themselves at the request deadline
+        deadline = time.monotonic() + self.request_timeout
+        events = queue.Queue()
+        for question_type, num_questions in branches:
+            cache_key = self._cache_key(session, question_type, num_questions, model)
+            cached = self.result_cache.get(cache_key) if use_cache else None
+            generation_metadata['cache'][question_type] = 'hit' if cached is not None else ('miss' if use_cache else 'bypass')
+            if cached is not None:
+                for question in cached:
+                    events.put(question)
+                events.put((question_type, None))
+            else:
+                future = metrics.submit(self.executor, self._stream_questions_for_type, session, question_type, num_questions,
+                                        model, events, cache_key if self._cacheable(session) else None, deadline)
+                self._hold_until_done(session, future)
+        
+        requested = dict(branches)
+        generated = {question_type: 0 for question_type in requested}
+        while len(generation_metadata['status']) < len(branches):
+            try:
+                event = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                print(f"Timed out streaming questions after {self.request_timeout}s")
+                for question_type in requested:
+                    if question_type not in generation_metadata['status']:
+                        generation_metadata['status'][question_type] = self._generation_status(
+                            requested[question_type], generated[question_type], 'timeout')
+                return
+            if isinstance(event, tuple):
+                question_type, error = event
+                generation_metadata['status'][question_type] = self._generation_status(
+                    requested[question_type], generated[question_type])
+                if error:
+                    generation_metadata['errors'][question_type] = error
+            else:
+                generated[event['type']] += 1
+                yield event
+    
+    def _stream_questions_for_type(self, session, question_type, num_questions, model, events, cache_key=None,
+                                   deadline=None):
+        """
+        Stream questions of a single type into the events queue, until deadline (monotonic time)
+        """
+        error = None
         try:
-            # Create the prompt with context chunks
-            context = "\n\n".join(context_chunks)
-            prompt = f"""
-            Generate {num_questions} open-ended questions about the following text:
-            
-            {context}
-            
-            IMPORTANT INSTRUCTIONS:
-            1. Create questions that are strictly based ONLY on the information contained in the text above.
-            2. Do not use any external knowledge or information not present in the provided text.
-            3. The questions and answers MUST be in the SAME LANGUAGE as the input text.
-               - If the text is in French, generate questions and answers in French.
-               - If the text is in Arabic, generate questions and answers in Arabic.
-               - Always match the exact language of the original text.
-            
-            Each question should:
-            1. Be an open-ended question (not multiple choice)
-            2. Include a comprehensive reference answer that can be directly verified from the text
-            3. Encourage thoughtful responses rather than simple yes/no or one-word answers
-            
-            Format the response as JSON:
+            context_chunks, _ = self._pack_context(
+                self.rag_service.get_context_documents(session, question_type, num_questions), model)
+            prompt = self._questions_prompt(question_type, context_chunks, num_questions)
+            config = self._structured_config(question_type) if self.structured_output else None
+            
+            print(f"Streaming request to Gemini API for {question_type} questions...")
+            
+            labels = {'question_type': question_type, 'model': model}
+            metrics.inc("qcm_llm_calls_total", labels=labels)
+            metrics.inc("qcm_llm_prompt_chars_total", len(prompt), labels=labels)
+            
+            parser = IncrementalQuestionParser()
+            emitted = []
+            question_vectors = {}
+            response_chars = 0
+            usage = None
+            stream = self.gateway.generate_content_stream(model=model, contents=prompt, config=config, deadline=deadline)
+            try:
+                for chunk in metrics.timed_iter(stream, "llm_stream"):
+                    response_chars += len(chunk.text or "")
+                    usage = getattr(chunk, 'usage_metadata', None) or usage
+                    questions = parser.feed(chunk.text or "")
+                    if self.structured_output:
+                        questions = self._validate_questions(question_type, questions)
+                    # Deduplicated like the non-streaming path, against what was already sent
+                    for question in self._unseen_questions(emitted, questions, question_vectors)[:num_questions - len(emitted)]:
+                        question['type'] = question_type
+                        events.put(question)
+                        emitted.append(question)
+                    if self._past_deadline(deadline):
+                        print(f"Stopped streaming {question_type} questions at the request deadline")
+                        break
+            finally:
+                # Frees the gateway's concurrency slot when the stream is left early
+                stream.close()
+            
+            self._record_response_size(labels, response_chars, usage)
+            print(f"Streamed {len(emitted)} {question_type} questions")
+            
+            # Ask again, without streaming, for the questions the stream missed
+            if self.structured_output and len(emitted) < num_questions:
+                collected = self._generate_structured(question_type, context_chunks, num_questions, model,
+                                                      collected=emitted, first_attempt=1, deadline=deadline,
+                                                      question_vectors=question_vectors)
+                # Selected by identity: dedup may have dropped or reordered the questions collected
+                sent = {id(question) for question in emitted}
+                missing = [question for question in collected if id(question) not in sent]
+                for question in missing[:num_questions - len(emitted)]:
+                    question['type'] = question_type
+                    events.put(question)
+                    emitted.append(question)
+            
+            if cache_key and len(emitted) >= num_questions:
+                self.result_cache.set(cache_key, emitted)
+        except Exception as e:
+            print(f"Error streaming {question_type} questions: {e}")
+            error = str(e)
+        finally:
+            events.put((question_type, error))
+    
+    def _generate_questions_for_type(self, session, question_type, num_questions, model, deadline=None):
+        """
+        Retrieve context and generate questions of a single type, without
+        starting LLM calls or retries past deadline (monotonic time); returns
+        the questions and the context packing statistics
+        """
+        documents = self.rag_service.get_context_documents(session, question_type, num_questions)
+        if num_questions > self.questions_per_batch:
+            questions, context_stats = self._generate_batched(question_type, documents, num_questions, model, deadline)
+        else:
+            context_chunks, context_stats = self._pack_context(documents, model)
+            questions = self._generate_group(question_type, context_chunks, num_questions, model, deadline)
+            if not self.structured_output:
+                # The structured path already deduplicates while collecting
+                questions = self._deduplicate_questions(questions)
+        for question in questions:
+            question['type'] = question_type
+        return questions, context_stats
+    
+    @staticmethod
+    def generation_outcome(generation_status, total_questions):
+        """
+        Outcome of a whole request from its per-type statuses: success when
+        every type is complete, partial with some questions, error without any
+        """
+        if all(entry['status'] == 'complete' for entry in generation_status.values()):
+            return 'success'
+        return 'partial' if total_questions else 'error'
+    
+    @staticmethod
+    def _past_deadline(deadline):
+        return deadline is not None and time.monotonic() >= deadline
+    
+    @staticmethod
+    def _generation_status(requested, generated, status=None):
+        """
+        Outcome of one question type: complete, partial, failed or timeout
+        """
+        if status is None:
+            status = 'complete' if generated >= requested else ('partial' if generated else 'failed')
+        return {'status': status, 'requested': requested, 'generated': generated}
+    
+    def _pack_context(self, documents, model):
+        """
+        Deduplicate, merge and budget retrieved chunks, returns (context_chunks, stats)
+        """
+        with metrics.span("context_pack"):
+            context_chunks, stats = self.context_packer.pack(documents, model)
+        metrics.inc("qcm_prompt_tokens_saved_total", stats['saved_tokens'], labels={'model': model})
+        return context_chunks, stats
+    
+    def _generate_group(self, question_type, context_chunks, num_questions, model, deadline=None):
+        """
+        Generate questions of one type from a single prompt
+        """
+        if self.structured_output:
+            return self._generate_structured(question_type, context_chunks, num_questions, model, deadline=deadline)
+        if question_type == 'open':
+            return self._generate_open_questions(context_chunks, num_questions, model, deadline)
+        return self._generate_yes_no_questions(context_chunks, num_questions, model, deadline)
+    
+    def _generate_batched(self, question_type, documents, num_questions, model, deadline=None):
+        """
+        Split a large request into groups of chunks and question counts, run
+        the groups in parallel and retry only the groups that failed (in
+        structured mode each group already re-requests its missing questions).
+        Returns (questions, summed context packing statistics)
+        """
+        num_groups = math.ceil(num_questions / self.questions_per_batch)
+        groups = []
+        context_stats = {}
+        for i in range(num_groups):
+            count = num_questions // num_groups + (1 if i < num_questions % num_groups else 0)
+            chunks, stats = self._pack_context(documents[i::num_groups] or documents, model)
+            groups.append((chunks, count))
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    context_stats[key] = context_stats.get(key, False) or value
+                else:
+                    context_stats[key] = context_stats.get(key, 0) + value
+        
+        print(f"Generating {num_questions} {question_type} questions in {num_groups} groups")
+        
+        results = [None] * num_groups
+        pending = list(range(num_groups))
+        group_retries = 0 if self.structured_output else self.max_batch_retries
+        for attempt in range(group_retries + 1):
+            if not pending or self._past_deadline(deadline):
+                break
+            if attempt > 0:
+                print(f"Retrying {len(pending)} failed {question_type} group(s), attempt {attempt}")
+            futures = {
+                i: metrics.submit(self.batch_executor, self._generate_group, question_type, groups[i][0], groups[i][1], model,
+                                  deadline)
+                for i in pending
+            }
+            failed = []
+            for i, future in futures.items():
+                try:
+                    questions = future.result()
+                except Exception as e:
+                    print(f"Error generating {question_type} group {i}: {e}")
+                    questions = []
+                if questions:
+                    results[i] = questions
+                else:
+                    failed.append(i)
+            pending = failed
+        
+        merged = [question for group in results if group for question in group]
+        return self._deduplicate_questions(merged)[:num_questions], context_stats
+    
+    def _deduplicate_questions(self, questions, question_vectors=None):
+        """
+        Drop questions that are paraphrases of an earlier one: cosine
+        similarity of their embeddings at or above question_dedup_threshold.
+        question_vectors (text -> vector) keeps the embeddings across the
+        dedup rounds of one call, so kept questions are not embedded again
+        """
+        if len(questions) < 2:
+            return questions
+        if question_vectors is None:
+            question_vectors = {}
+        texts = [str(question.get('question', '')) for question in questions]
+        with metrics.span("question_dedup"):
+            # Straight to the model: one-off question texts stay out of the chunk embedding cache
+            missing = list(dict.fromkeys(text for text in texts if text not in question_vectors))
+            if missing:
+                question_vectors.update(zip(missing, self.rag_service.embedding_engine.embed_documents(missing)))
+            kept = semantic_unique([question_vectors[text] for text in texts], self.question_dedup_threshold)
+        if len(kept) < len(questions):
+            print(f"Dropped {len(questions) - len(kept)} duplicate questions")
+        return [questions[i] for i in kept]
+    
+    def _unseen_questions(self, emitted, questions, question_vectors=None):
+        """
+        The questions that are neither duplicates of an emitted one nor of
+        each other; the emitted ones come first, so dedup always keeps them
+        """
+        if not questions:
+            return []
+        sent = {id(question) for question in emitted}
+        return [question for question in self._deduplicate_questions(emitted + questions, question_vectors) if id(question) not in sent]
+    
+    def _generate_structured(self, question_type, context_chunks, num_questions, model, collected=None, first_attempt=0,
+                             deadline=None, question_vectors=None):
+        """
+        Generate questions with a JSON response schema. Valid items of a
+        partial or malformed answer are kept and only the missing questions
+        are requested again, with exponential backoff between attempts, as
+        long as deadline (monotonic time) is not reached
+        """
+        collected = list(collected or [])
+        question_vectors = question_vectors if question_vectors is not None else {}
+        for attempt in range(first_attempt, self.max_parse_retries + 1):
+            missing = num_questions - len(collected)
+            if missing <= 0 or self._past_deadline(deadline):
+                break
+            if attempt > 0:
+                delay = self.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    break
+                print(f"Requesting {missing} missing {question_type} questions in {delay:.1f}s (attempt {attempt})")
+                time.sleep(delay)
+            
+            prompt = self._questions_prompt(question_type, context_chunks, missing,
+                                            exclude_questions=[question['question'] for question in collected])
+            try:
+                response = self._call_llm(question_type, model, prompt, config=self._structured_config(question_type),
+                                          deadline=deadline)
+                with metrics.span("json_parse"):
+                    questions, rejected = parse_question_items(response.text or "", QUESTION_SCHEMAS[question_type][0])
+            except Exception as e:
+                print(f"Error generating {question_type} questions: {e}")
+                continue
+            
+            self._record_validation(question_type, len(questions), rejected)
+            collected = self._deduplicate_questions(collected + questions, question_vectors)
+            print(f"Validated {len(questions)} {question_type} questions ({rejected} rejected), "
+                  f"{min(len(collected), num_questions)}/{num_questions} collected")
+        return collected[:num_questions]
+    
+    def _validate_questions(self, question_type, questions):
+        """
+        Keep the questions matching the schema of their type
+        """
+        valid, rejected = validate_question_items(questions, QUESTION_SCHEMAS[question_type][0])
+        self._record_validation(question_type, len(valid), rejected)
+        return valid
+    
+    @staticmethod
+    def _record_validation(question_type, valid, rejected):
+        metrics.inc("qcm_question_items_total", valid, labels={'question_type': question_type, 'result': 'valid'})
+        metrics.inc("qcm_question_items_total", rejected, labels={'question_type': question_type, 'result': 'rejected'})
+    
+    @staticmethod
+    def _structured_config(question_type):
+        from google.genai import types
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=QUESTION_SCHEMAS[question_type][1]
+        )
+    
+    def _call_llm(self, question_type, model, prompt, config=None, deadline=None):
+        """
+        Blocking Gemini call, recording its latency and prompt/response sizes;
+        the gateway does not start or retry it past deadline
+        """
+        labels = {'question_type': question_type, 'model': model}
+        metrics.inc("qcm_llm_calls_total", labels=labels)
+        metrics.inc("qcm_llm_prompt_chars_total", len(prompt), labels=labels)
+        with metrics.span("llm_call"):
+            response = self.gateway.generate_content(
+                model=model,
+                contents=prompt,
+                config=config,
+                deadline=deadline
+            )
+        self._record_response_size(labels, len(response.text or ""), getattr(response, 'usage_metadata', None))
+        return response
+    
+    @staticmethod
+    def _record_response_size(labels, response_chars, usage):
+        metrics.inc("qcm_llm_response_chars_total", response_chars, labels=labels)
+        if usage is not None:
+            metrics.inc("qcm_llm_prompt_tokens_total", getattr(usage, 'prompt_token_count', None) or 0, labels=labels)
+            metrics.inc("qcm_llm_response_tokens_total", getattr(usage, 'candidates_token_count', None) or 0, labels=labels)
+    
+    def _questions_prompt(self, question_type, context_chunks, num_questions, exclude_questions=None):
+        if question_type == 'open':
+            return self._open_questions_prompt(context_chunks, num_questions, exclude_questions)
+        return self._yes_no_questions_prompt(context_chunks, num_questions, exclude_questions)
+    
+    @staticmethod
+    def _exclusion_instructions(exclude_questions):
+        """
+        Prompt lines listing the questions already generated, when asking for the missing ones
+        """
+        if not exclude_questions:
+            return ""
+        listed = "\n".join(f"        - {question}" for question in exclude_questions)
+        return f"\n        Do NOT repeat any of these already generated questions:\n{listed}\n"
+    
+    def _open_questions_prompt(self, context_chunks, num_questions, exclude_questions=None):
+        """
+        Build the prompt asking for open-ended questions about the context chunks
+        """
+        context = "\n\n".join(context_chunks)
+        return f"""
+        Generate {num_questions} open-ended questions about the following text:
+        
+        {context}
+        
+        IMPORTANT INSTRUCTIONS:
+        1. Create questions that are strictly based ONLY on the information contained in the text above.
+        2. Do not use any external knowledge or information not present in the provided text.
+        3. The questions and answers MUST be in the SAME LANGUAGE as the input text.
+           - If the text is in French, generate questions and answers in French.
+           - If the text is in Arabic, generate questions and answers in Arabic.
+           - Always match the exact language of the original text.
+        
+        Each question should:
+        1. Be an open-ended question (not multiple choice)
+        2. Include a comprehensive reference answer that can be directly verified from the text
+        3. Encourage thoughtful responses rather than simple yes/no or one-word answers
+        {self._exclusion_instructions(exclude_questions)}
+        Format the response as JSON:
+        {{
+          "questions": [
             {{
-              "questions": [
-                {{
-                  "question": "...",
-                  "reference_answer": "..."
-                }}
-              ]
+              "question": "...",
+              "reference_answer": "..."
             }}
-            
-            Provide ONLY the JSON with no additional text.
-            """
+          ]
+        }}
+        
+        Provide ONLY the JSON with no additional text.
+        """
+    
+    def _generate_open_questions(self, context_chunks, num_questions, model, deadline=None):
+        """
+        Generate open-ended questions with reference answers
+        """
+        try:
+            # Create the prompt with context chunks
+            prompt = self._open_questions_prompt(context_chunks, num_questions)
             
             print("Sending request to Gemini API for open questions...")
             
             # Make the request to Gemini API
-            response = self.client.models.generate_content(
-                model=model,
-                contents=prompt
-            )
+            response = self._call_llm('open', model, prompt, deadline=deadline)
             
             print(f"Response received from Gemini API")
             
@@ -114,27 +617,28 @@ class QCMGenerator:
             content = response.text
             
             # Try to parse JSON from content
-            try:
-                # Find JSON object in content
-                start_index = content.find("{")
-                end_index = content.rfind("}") + 1
+            with metrics.span("json_parse"):
+                try:
+                    # Find JSON object in content
+                    start_index = content.find("{")
+                    end_index = content.rfind("}") + 1
                 
-                if start_index >= 0 and end_index > start_index:
-                    json_str = content[start_index:end_index]
-                    parsed_data = json.loads(json_str)
+                    if start_index >= 0 and end_index > start_index:
+                        json_str = content[start_index:end_index]
+                        parsed_data = json.loads(json_str)
                     
-                    # Extract questions
-                    questions = parsed_data.get("questions", [])
-                    if questions:
-                        print(f"Successfully extracted {len(questions)} open questions")
-                        return questions
+                        # Extract questions
+                        questions = parsed_data.get("questions", [])
+                        if questions:
+                            print(f"Successfully extracted {len(questions)} open questions")
+                            return questions
+                        else:
+                            print("No open questions found in parsed data")
                     else:
-                        print("No open questions found in parsed data")
-                else:
-                    print("Could not find JSON in response content")
-            except Exception as e:
-                print(f"Error parsing JSON: {e}")
-                print(f"Content: {content[:200]}...")  # Print first 200 chars
+                        print("Could not find JSON in response content")
+                except Exception as e:
+                    print(f"Error parsing JSON: {e}")
+                    print(f"Content: {content[:200]}...")  # Print first 200 chars
             
             return []
             
@@ -144,52 +648,55 @@ class QCMGenerator:
             traceback.print_exc()
             return []
     
-    def _generate_yes_no_questions(self, context_chunks, num_questions, model):
+    def _yes_no_questions_prompt(self, context_chunks, num_questions, exclude_questions=None):
+        """
+        Build the prompt asking for yes/no questions about the context chunks
+        """
+        context = "\n\n".join(context_chunks)
+        return f"""
+        Generate {num_questions} yes/no questions about the following text:
+        
+        {context}
+        
+        IMPORTANT INSTRUCTIONS:
+        1. Create questions that are strictly based ONLY on the information contained in the text above.
+        2. Do not use any external knowledge or information not present in the provided text.
+        3. The questions and answers MUST be in the SAME LANGUAGE as the input text.
+           - If the text is in French, generate questions and answers in French.
+           - If the text is in Arabic, generate questions and answers in Arabic.
+           - Always match the exact language of the original text.
+        
+        Each question should:
+        1. Be answerable with a clear "yes" or "no" answer
+        2. Include the correct answer (yes/no)
+        3. Include a justification that explains why the answer is correct, citing specific information from the text
+        {self._exclusion_instructions(exclude_questions)}
+        Format the response as JSON:
+        {{
+          "questions": [
+            {{
+              "question": "...",
+              "answer": "yes/no",
+              "justification": "..."
+            }}
+          ]
+        }}
+        
+        Provide ONLY the JSON with no additional text.
+        """
+    
+    def _generate_yes_no_questions(self, context_chunks, num_questions, model, deadline=None):
         """
         Generate yes/no questions with answers and justifications
         """
         try:
             # Create the prompt with context chunks
-            context = "\n\n".join(context_chunks)
-            prompt = f"""
-            Generate {num_questions} yes/no questions about the following text:
-            
-            {context}
-            
-            IMPORTANT INSTRUCTIONS:
-            1. Create questions that are strictly based ONLY on the information contained in the text above.
-            2. Do not use any external knowledge or information not present in the provided text.
-            3. The questions and answers MUST be in the SAME LANGUAGE as the input text.
-               - If the text is in French, generate questions and answers in French.
-               - If the text is in Arabic, generate questions and answers in Arabic.
-               - Always match the exact language of the original text.
-            
-            Each question should:
-            1. Be answerable with a clear "yes" or "no" answer
-            2. Include the correct answer (yes/no)
-            3. Include a justification that explains why the answer is correct, citing specific information from the text
-            
-            Format the response as JSON:
-            {{
-              "questions": [
-                {{
-                  "question": "...",
-                  "answer": "yes/no",
-                  "justification": "..."
-                }}
-              ]
-            }}
-            
-            Provide ONLY the JSON with no additional text.
-            """
+            prompt = self._yes_no_questions_prompt(context_chunks, num_questions)
             
             print("Sending request to Gemini API for yes/no questions...")
             
             # Make the request to Gemini API
-            response = self.client.models.generate_content(
-                model=model,
-                contents=prompt
-            )
+            response = self._call_llm('yes_no', model, prompt, deadline=deadline)
             
             print(f"Response received from Gemini API")
             
@@ -197,27 +704,28 @@ class QCMGenerator:
             content = response.text
             
             # Try to parse JSON from content
-            try:
-                # Find JSON object in content
-                start_index = content.find("{")
-                end_index = content.rfind("}") + 1
+            with metrics.span("json_parse"):
+                try:
+                    # Find JSON object in content
+                    start_index = content.find("{")
+                    end_index = content.rfind("}") + 1
                 
-                if start_index >= 0 and end_index > start_index:
-                    json_str = content[start_index:end_index]
-                    parsed_data = json.loads(json_str)
+                    if start_index >= 0 and end_index > start_index:
+                        json_str = content[start_index:end_index]
+                        parsed_data = json.loads(json_str)
                     
-                    # Extract questions
-                    questions = parsed_data.get("questions", [])
-                    if questions:
-                        print(f"Successfully extracted {len(questions)} yes/no questions")
-                        return questions
+                        # Extract questions
+                        questions = parsed_data.get("questions", [])
+                        if questions:
+                            print(f"Successfully extracted {len(questions)} yes/no questions")
+                            return questions
+                        else:
+                            print("No yes/no questions found in parsed data")
                     else:
-                        print("No yes/no questions found in parsed data")
-                else:
-                    print("Could not find JSON in response content")
-            except Exception as e:
-                print(f"Error parsing JSON: {e}")
-                print(f"Content: {content[:200]}...")  # Print first 200 chars
+                        print("Could not find JSON in response content")
+                except Exception as e:
+                    print(f"Error parsing JSON: {e}")
+                    print(f"Content: {content[:200]}...")  # Print first 200 chars
             
             return []
             
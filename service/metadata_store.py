@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class MetadataStore:
+    """
+    Append-only store of processed-document metadata in sqlite (WAL mode).
+    Each save is a single insert, lookups by document hash and filename go
+    through indexes, and the legacy ./metadata/document_metadata.json list
+    is imported once on first use
+    """
+
+    def __init__(self, db_path: str = "./metadata/document_metadata.sqlite",
+                 legacy_json_path: Optional[str] = "./metadata/document_metadata.json"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_metadata ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " document_id TEXT,"
+            " filename TEXT,"
+            " processed_date TEXT,"
+            " created_at REAL NOT NULL,"
+            " metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_document_id ON document_metadata (document_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_filename ON document_metadata (filename)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at REAL NOT NULL)")
+        self._conn.commit()
+
+        if legacy_json_path:
+            self._migrate_legacy_json(legacy_json_path)
+
+    @staticmethod
+    def _row(metadata: Dict, created_at: float) -> Tuple:
+        return (metadata.get('document_id'), metadata.get('filename'), metadata.get('processed_date'),
+                created_at, json.dumps(metadata))
+
+    def append(self, metadata: Dict) -> None:
+        """Record the metadata of a processed document"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO document_metadata (document_id, filename, processed_date, created_at, metadata)"
+                " VALUES (?, ?, ?, ?, ?)",
+                self._row(metadata, time.time())
+            )
+            self._conn.commit()
+
+    def get(self, document_id: str) -> Optional[Dict]:
+        """Latest metadata recorded for a document hash"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT metadata FROM document_metadata WHERE document_id = ? ORDER BY id DESC LIMIT 1",
+                (document_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_filename(self, filename: str) -> List[Dict]:
+        """Every metadata entry recorded for a filename, most recent first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT metadata FROM document_metadata WHERE filename = ? ORDER BY id DESC",
+                (filename,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def list_entries(self, offset: int = 0, limit: Optional[int] = 50,
+                     filename: Optional[str] = None) -> Tuple[List[Dict], int]:
+        """One page of entries, most recent first, returns (entries, total count)"""
+        where, params = ("WHERE filename = ?", (filename,)) if filename else ("", ())
+        with self._lock:
+            (total,) = self._conn.execute(f"SELECT COUNT(*) FROM document_metadata {where}", params).fetchone()
+            rows = self._conn.execute(
+                f"SELECT metadata FROM document_metadata {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                params + (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    def _migrate_legacy_json(self, json_path: str) -> None:
+        # Workers starting together race for the import: the check, the
+        # import and the marker share one write transaction, so exactly one
+        # of them imports the history and the others see it done
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM migrations WHERE name = 'legacy_json'").fetchone():
+                    self._conn.rollback()
+                    return
+                if os.path.exists(json_path):
+                    try:
+                        with open(json_path, "r") as f:
+                            entries = json.load(f)
+                    except (json.JSONDecodeError, OSError) as e:
+                        # Keep the file and retry on next start rather than losing history
+                        print(f"Warning: could not migrate {json_path}: {e}")
+                        self._conn.rollback()
+                        return
+                    if not isinstance(entries, list):
+                        entries = []
+                    # Entries of the JSON list were appended in order, keep that order
+                    now = time.time()
+                    self._conn.executemany(
+                        "INSERT INTO document_metadata (document_id, filename, processed_date, created_at, metadata)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        [self._row(entry, now) for entry in entries if isinstance(entry, dict)]
+                    )
+                    print(f"Migrated {len(entries)} metadata entries from {json_path}")
+                self._conn.execute("INSERT INTO migrations (name, applied_at) VALUES ('legacy_json', ?)", (time.time(),))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        # Only once the import is committed; another worker may have moved it already
+        try:
+            os.replace(json_path, json_path + ".migrated")
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,190 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class RequestTimings:
+    """Per-request breakdown of the time spent in each stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def breakdown(self) -> Dict:
+        # Stages overlap (parallel branches, nested spans), so their sum can
+        # exceed the wall time
+        with self._lock:
+            stages = {
+                stage: {'seconds': round(total, 4), 'count': count}
+                for stage, (total, count) in sorted(self.stages.items())
+            }
+        return {'wall_seconds': round(time.perf_counter() - self.started, 4), 'stages': stages}
+
+
+_current_timings = contextvars.ContextVar("qcm_request_timings", default=None)
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms rendered in the Prometheus text format"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str) -> None:
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict]) -> Tuple:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict] = None) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def gauge_add(self, name: str, value: float, labels: Optional[Dict] = None) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time a block as one stage, in the stage histogram and the current request breakdown"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe("qcm_stage_duration_seconds", seconds, {'stage': stage})
+            timings = _current_timings.get()
+            if timings is not None:
+                timings.add(stage, seconds)
+
+    def timed_iter(self, iterable: Iterable, stage: str) -> Iterator:
+        """Yield from iterable, timing each step (e.g. lazily loaded PDF pages) as a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.span(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @staticmethod
+    def start_request_timings() -> Tuple[RequestTimings, contextvars.Token]:
+        """Start collecting a per-request stage breakdown in the current context"""
+        timings = RequestTimings()
+        return timings, _current_timings.set(timings)
+
+    @staticmethod
+    def stop_request_timings(token: contextvars.Token) -> None:
+        try:
+            _current_timings.reset(token)
+        except ValueError:
+            # Token from another context (e.g. a response streamed elsewhere)
+            _current_timings.set(None)
+
+    @staticmethod
+    def submit(executor, function, *args, **kwargs):
+        """executor.submit that keeps the caller's request breakdown in the worker thread"""
+        return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                          for key, h in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name, default_type):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._types.get(name, default_type)}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# Process-wide registry shared by app.py, RAGService and QCMGenerator
+metrics = MetricsRegistry()
+metrics.describe("qcm_stage_duration_seconds", "histogram", "Time spent per processing stage")
+metrics.describe("qcm_http_request_duration_seconds", "histogram", "HTTP request latency per endpoint")
+metrics.describe("qcm_http_requests_total", "counter", "HTTP requests per endpoint and status")
+metrics.describe("qcm_requests_in_flight", "gauge", "HTTP requests currently being handled")
+metrics.describe("qcm_llm_calls_total", "counter", "Gemini calls per question type")
+metrics.describe("qcm_llm_prompt_chars_total", "counter", "Characters sent to Gemini")
+metrics.describe("qcm_llm_response_chars_total", "counter", "Characters received from Gemini")
+metrics.describe("qcm_llm_prompt_tokens_total", "counter", "Prompt tokens reported by Gemini")
+metrics.describe("qcm_llm_response_tokens_total", "counter", "Response tokens reported by Gemini")
+metrics.describe("qcm_prompt_tokens_saved_total", "counter", "Estimated prompt tokens removed by context packing")
+metrics.describe("qcm_cache_lookups_total", "counter", "Cache lookups per cache and result")
+metrics.describe("qcm_question_items_total", "counter", "Generated question items per schema validation result")
+metrics.describe("qcm_startup_seconds", "histogram", "Time spent building each process-wide resource")
+metrics.describe("qcm_llm_queue_depth", "gauge", "Gemini calls waiting for the rate limiter or a concurrency slot")
+metrics.describe("qcm_llm_in_flight", "gauge", "Gemini calls currently running")
+metrics.describe("qcm_llm_wait_seconds", "histogram", "Time a Gemini call waited before being sent")
+metrics.describe("qcm_llm_retries_total", "counter", "Gemini calls retried per error code")
+metrics.describe("qcm_chunks_dropped_total", "counter", "Chunks dropped at ingest before embedding")
+metrics.describe("qcm_text_ingest_total", "counter", "Raw texts processed per index mode (inline or ephemeral)")
+metrics.describe("qcm_batch_items_total", "counter", "Batch generation items per outcome")
+metrics.describe("qcm_batch_duration_seconds", "histogram", "Time to process a whole generation batch")
+metrics.describe("qcm_uploads_total", "counter", "Uploaded files, new or duplicate of a stored file")
+metrics.describe("qcm_upload_files_removed_total", "counter", "Uploaded files removed by the age and quota cleanup")
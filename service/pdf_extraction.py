@@ -0,0 +1,184 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from .metrics import metrics
+from .sqlite_lru import SqliteLRUCache
+
+
+def _resolved(value, depth: int = 0) -> str:
+    """Stable text form of a PDF object, indirect references resolved (their repr is per reader)"""
+    if depth > 8:
+        return ""
+    value = value.get_object() if hasattr(value, "get_object") else value
+    if hasattr(value, "get_data"):
+        return hashlib.sha256(value.get_data()).hexdigest()
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}:{_resolved(item, depth + 1)}" for key, item in sorted(value.items())) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(_resolved(item, depth + 1) for item in value) + "]"
+    return str(value)
+
+
+def page_digest(page) -> str:
+    """
+    Digest of what pypdf reads to extract a page's text: its content stream,
+    the content of its form XObjects, its fonts (name, ToUnicode map,
+    encoding and glyph widths) and its rotation. Unchanged pages of a
+    revised PDF keep their digest
+    """
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    digest.update(str(page.get("/Rotate", 0)).encode())
+
+    resources = page.get("/Resources")
+    resources = resources.get_object() if resources is not None else {}
+    fonts = resources.get("/Font")
+    for name, font in sorted((fonts.get_object() if fonts is not None else {}).items()):
+        font = font.get_object()
+        digest.update(f"{name}:{font.get('/BaseFont')}".encode())
+        # Character codes map to text through the encoding, and widths place the spaces
+        for key in ("/Encoding", "/FirstChar", "/Widths"):
+            if key in font:
+                digest.update(f"{key}={_resolved(font[key])}".encode())
+        to_unicode = font.get("/ToUnicode")
+        if to_unicode is not None:
+            digest.update(to_unicode.get_object().get_data())
+    xobjects = resources.get("/XObject")
+    for name, xobject in sorted((xobjects.get_object() if xobjects is not None else {}).items()):
+        xobject = xobject.get_object()
+        if xobject.get("/Subtype") == "/Form":
+            digest.update(name.encode())
+            digest.update(xobject.get_data())
+    return digest.hexdigest()
+
+
+def extract_page_texts(pdf_path: str, page_numbers: List[int]) -> List[str]:
+    """Text of the given pages (0-based). Module-level so that it can run in a worker process"""
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    return [reader.pages[number].extract_text() for number in page_numbers]
+
+
+class PageTextCache(SqliteLRUCache):
+    """Persistent, size-bounded LRU cache of extracted page texts stored in sqlite, keyed by page digest"""
+
+    table = "pages"
+    value_column = "text"
+    value_type = "TEXT"
+    metrics_label = "pdf_page"
+
+    def __init__(self, cache_path: str = "./pdf_cache/pages.sqlite", max_entries: int = 100_000):
+        super().__init__(cache_path, max_entries)
+
+
+class PdfExtractor:
+    """
+    PDF text extraction with pypdf: pages whose digest is in the page cache
+    are not extracted again, the others are fanned out in runs of
+    pages_per_task over a process pool (in-process below min_pages_for_pool
+    pages or with max_processes <= 1). Pages come out in order, with the
+    page metadata PyPDFLoader sets, so the splitter sees the same documents.
+    At most max_tasks_in_flight runs are extracted ahead of the page being
+    read, which bounds the memory held by results of large files
+    """
+
+    def __init__(self, cache: Optional[PageTextCache] = None, max_processes: Optional[int] = None,
+                 pages_per_task: int = 8, min_pages_for_pool: int = 16, max_tasks_in_flight: Optional[int] = None):
+        self.cache = cache
+        if max_processes is None:
+            # 0 (the default): one process per core
+            max_processes = int(os.environ.get("PDF_EXTRACT_PROCESSES", 0)) or os.cpu_count() or 1
+        self.max_processes = max_processes
+        self.pages_per_task = pages_per_task
+        self.min_pages_for_pool = min_pages_for_pool
+        self.max_tasks_in_flight = max_tasks_in_flight or 2 * self.max_processes
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Started on first use, shared by every extraction of this process
+        with self._pool_lock:
+            if self._pool is None:
+                # Started from request threads, see IngestionJobQueue
+                self._pool = ProcessPoolExecutor(max_workers=self.max_processes,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    @staticmethod
+    def cache_key(digest: str) -> str:
+        # Another pypdf version may extract the same page differently
+        from pypdf import __version__
+        return f"pypdf-{__version__}:{digest}"
+
+    def extract(self, pdf_path: str) -> List[Document]:
+        """All pages of a PDF, in order"""
+        return list(self.lazy_extract(pdf_path))
+
+    def lazy_extract(self, pdf_path: str) -> Iterator[Document]:
+        """Yield the pages of a PDF in order; extraction of the first missing pages starts right away"""
+        from pypdf import PdfReader
+        reader = PdfReader(pdf_path)
+        total_pages = len(reader.pages)
+        page_labels = reader.page_labels
+
+        with metrics.span("pdf_digest"):
+            keys = [self.cache_key(page_digest(page)) for page in reader.pages]
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+        missing = [number for number, key in enumerate(keys) if key not in cached]
+        if cached:
+            print(f"Reusing {total_pages - len(missing)}/{total_pages} extracted pages of {os.path.basename(pdf_path)}")
+
+        runs = []
+        if self.max_processes > 1 and len(missing) >= self.min_pages_for_pool:
+            runs = [missing[i:i + self.pages_per_task] for i in range(0, len(missing), self.pages_per_task)]
+        # Page number -> (run, position of the page in its run)
+        run_of = {number: (index, position) for index, run in enumerate(runs) for position, number in enumerate(run)}
+        # Run -> future, submitted up to max_tasks_in_flight runs ahead
+        tasks = {}
+        submitted = 0
+
+        def submit_until(limit):
+            nonlocal submitted
+            while submitted < min(limit, len(runs)):
+                tasks[submitted] = self._get_pool().submit(extract_page_texts, pdf_path, runs[submitted])
+                submitted += 1
+
+        extracted = {}
+        try:
+            submit_until(self.max_tasks_in_flight)
+            for number, key in enumerate(keys):
+                if key in cached:
+                    text = cached[key]
+                elif number in run_of:
+                    index, position = run_of[number]
+                    submit_until(index + self.max_tasks_in_flight)
+                    text = tasks[index].result()[position]
+                    if position == len(runs[index]) - 1:
+                        del tasks[index]
+                    extracted[key] = text
+                else:
+                    text = reader.pages[number].extract_text()
+                    extracted[key] = text
+                if len(extracted) >= self.pages_per_task and self.cache is not None:
+                    self.cache.put_many(extracted)
+                    extracted = {}
+                yield Document(page_content=text, metadata={
+                    'source': pdf_path,
+                    'total_pages': total_pages,
+                    'page': number,
+                    'page_label': page_labels[number]
+                })
+        finally:
+            for future in tasks.values():
+                future.cancel()
+            if extracted and self.cache is not None:
+                self.cache.put_many(extracted)
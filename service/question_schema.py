@@ -0,0 +1,82 @@
+import json
+from typing import Dict, List, Literal, Tuple, Type
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+from .stream_parser import IncrementalQuestionParser
+
+
+class OpenQuestion(BaseModel):
+    question: str
+    reference_answer: str
+
+    @field_validator("question", "reference_answer")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be blank")
+        return value.strip()
+
+
+class YesNoQuestion(BaseModel):
+    question: str
+    answer: Literal["yes", "no"]
+    justification: str
+
+    @field_validator("answer", mode="before")
+    @classmethod
+    def normalize_answer(cls, value):
+        # The answer may come back in the language of the text
+        normalized = str(value).strip().lower()
+        return {"oui": "yes", "non": "no", "نعم": "yes", "لا": "no"}.get(normalized, normalized)
+
+    @field_validator("question", "justification")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be blank")
+        return value.strip()
+
+
+class OpenQuestionSet(BaseModel):
+    questions: List[OpenQuestion]
+
+
+class YesNoQuestionSet(BaseModel):
+    questions: List[YesNoQuestion]
+
+
+# Item and response models per question type, the response model is sent to
+# Gemini as the response schema
+QUESTION_SCHEMAS: Dict[str, Tuple[Type[BaseModel], Type[BaseModel]]] = {
+    'open': (OpenQuestion, OpenQuestionSet),
+    'yes_no': (YesNoQuestion, YesNoQuestionSet),
+}
+
+
+def parse_question_items(content: str, item_model: Type[BaseModel]) -> Tuple[List[Dict], int]:
+    """
+    Validate every question of a {"questions": [...]} response, returns
+    (valid questions, number of rejected items). Truncated or otherwise
+    malformed responses are salvaged object by object
+    """
+    try:
+        parsed = json.loads(content)
+        items = parsed.get("questions", []) if isinstance(parsed, dict) else parsed
+        if not isinstance(items, list):
+            items = []
+    except (json.JSONDecodeError, AttributeError):
+        items = IncrementalQuestionParser().feed(content)
+    return validate_question_items(items, item_model)
+
+
+def validate_question_items(items: List, item_model: Type[BaseModel]) -> Tuple[List[Dict], int]:
+    """Returns (items matching item_model as dicts, number of rejected items)"""
+    valid = []
+    rejected = 0
+    for item in items:
+        try:
+            valid.append(item_model.model_validate(item).model_dump())
+        except ValidationError:
+            rejected += 1
+    return valid, rejected
@@ -1,139 +1,637 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from .embedding_cache import CachedEmbeddings
+from .document_registry import DocumentRegistry
+from .document_session import DocumentSession
+from .dedup import BOILERPLATE_SAMPLE_PAGES, NearDuplicateFilter, detect_headers_footers, strip_headers_footers
+from .metrics import metrics
+from .resources import resources
+from .retrieval import mmr_select, kmeans_select, page_stratified_select
+import copy
+import math
+import numpy as np
 import os
-from typing import List, Dict
-import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 
-import shutil
-import time
+try:
+    import fcntl
+except ImportError:  # Windows: index writes are only serialized within the process
+    fcntl = None
 
-class RAGService:
-    def __init__(self):
-        # Initialize the embedding model
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+# LangChain community, Chroma and pypdf are only imported when
+# first used, so importing this module (e.g. in a worker process) stays fast
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+
+
+def make_text_splitter(chunk_size: int, chunk_overlap: int, tokenizer_model: Optional[str] = None):
+    """Recursive splitter measuring chunk_size and chunk_overlap in characters,
+    or in tokens of tokenizer_model's tokenizer when one is given"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    if tokenizer_model:
+        class OffsetTextSplitter(RecursiveCharacterTextSplitter):
+            # LangChain looks for each chunk chunk_overlap characters before
+            # the end of the previous one, but the overlap is in tokens here:
+            # it would start past the real start and record -1 or a later
+            # occurrence. Chunks come in order, so search from the previous start
+            def create_documents(self, texts, metadatas=None):
+                metadatas = metadatas or [{}] * len(texts)
+                documents = []
+                for text, metadata in zip(texts, metadatas):
+                    start = -1
+                    for chunk in self.split_text(text):
+                        found = text.find(chunk, start + 1)
+                        start = found if found >= 0 else start
+                        chunk_metadata = copy.deepcopy(metadata)
+                        chunk_metadata['start_index'] = found
+                        documents.append(Document(page_content=chunk, metadata=chunk_metadata))
+                return documents
+
+        return OffsetTextSplitter.from_huggingface_tokenizer(
+            resources.tokenizer(tokenizer_model),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True,
         )
-        self.vector_store = None
-        self.documents = []
-        self.current_document_metadata = {}
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        add_start_index=True,
+    )
+
+def load_and_split_pdf(pdf_path: str, chunk_size: int, chunk_overlap: int, dedup: bool = True,
+                       tokenizer_model: Optional[str] = None) -> Tuple[int, List[Document]]:
+    """Load a PDF and split it into chunks, returns (total_pages, chunks).
+    With dedup, running headers/footers are stripped and near-duplicate
+    chunks dropped. Module-level so that it can run in a worker process,
+    where pages are extracted in-process (the caller already runs one PDF
+    per core) but still go through the page cache"""
+    pages = resources.pdf_extractor(max_processes=1).extract(pdf_path)
+    if dedup:
+        pages = strip_headers_footers(pages, detect_headers_footers(pages[:BOILERPLATE_SAMPLE_PAGES]))
+    chunks = make_text_splitter(chunk_size, chunk_overlap, tokenizer_model).split_documents(pages)
+    if dedup:
+        chunks = NearDuplicateFilter().filter(chunks)
+    return len(pages), chunks
 
+
+class EmbeddingEngine(Embeddings):
+    """
+    Batched sentence-transformers embedding stage: texts are sorted by length
+    so each batch pads as little as possible, large inputs can be spread over
+    a multi-process pool, and every batch is timed
+    """
+    
+    # Quantized int8 ONNX export shipped with the sentence-transformers models
+    # (qint8 exports exist for avx512, avx512_vnni and arm64 CPUs)
+    ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+    
+    def __init__(self, model_name: str, batch_size: int = 64, num_processes: int = 0,
+                 backend: str = "torch", multi_process_threshold: int = 512, onnx_int8_file: Optional[str] = None):
+        from sentence_transformers import SentenceTransformer
+        
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_processes = num_processes
+        self.backend = backend
+        self.multi_process_threshold = multi_process_threshold
+        # Identifies the vectors the model produces, for the embedding cache
+        self.variant = backend
+        
+        if backend == "torch":
+            self.model = SentenceTransformer(model_name, device="cpu")
+        elif backend == "onnx":
+            self.model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        elif backend == "onnx-int8":
+            onnx_int8_file = onnx_int8_file or os.environ.get("EMBEDDING_ONNX_INT8_FILE", self.ONNX_INT8_FILE)
+            self.model = SentenceTransformer(model_name, device="cpu", backend="onnx",
+                                             model_kwargs={"file_name": onnx_int8_file})
+            self.variant = f"{backend}:{onnx_int8_file}"
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        
+        # Word-pieces the model reads per input (special tokens included),
+        # anything beyond is truncated before encoding
+        self.max_seq_length = self.model.max_seq_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.batch_timings = deque(maxlen=1000)
+        self.total_chunks = 0
+        self.total_seconds = 0.0
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        
+        # Length-sorted order, scattered back to the input order at the end
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+        
+        if self.num_processes > 1 and len(texts) >= self.multi_process_threshold:
+            start = time.perf_counter()
+            with metrics.span("embed"):
+                vectors = self.model.encode_multi_process(sorted_texts, self._get_pool(), batch_size=self.batch_size)
+            self._record_batch(sorted_texts, time.perf_counter() - start)
+        else:
+            batches = []
+            for i in range(0, len(sorted_texts), self.batch_size):
+                batch = sorted_texts[i:i + self.batch_size]
+                start = time.perf_counter()
+                with metrics.span("embed"):
+                    batches.extend(self.model.encode(batch, batch_size=len(batch), convert_to_numpy=True))
+                self._record_batch(batch, time.perf_counter() - start)
+            vectors = batches
+        
+        result = [None] * len(texts)
+        for position, index in enumerate(order):
+            result[index] = [float(x) for x in vectors[position]]
+        return result
+    
+    def embed_query(self, text: str) -> List[float]:
+        with metrics.span("embed_query"):
+            return [float(x) for x in self.model.encode(text, convert_to_numpy=True)]
     
-    ## NOT Working as expected to review later
-    def cleanup_vector_store(self):
-        """Clean up the vector store and its files"""
-        import shutil, os, time
-        from chromadb import PersistentClient
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                print(f"Starting embedding pool with {self.num_processes} processes")
+                self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.num_processes)
+            return self._pool
+    
+    def close(self) -> None:
+        """Stop the multi-process pool if it was started"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+    
+    def _record_batch(self, batch: List[str], seconds: float) -> None:
+        with self._metrics_lock:
+            self.batch_timings.append({
+                'size': len(batch),
+                'chars': sum(len(text) for text in batch),
+                'seconds': seconds
+            })
+            self.total_chunks += len(batch)
+            self.total_seconds += seconds
+    
+    def stats(self) -> Dict:
+        """Get throughput and per-batch timing metrics"""
+        with self._metrics_lock:
+            timings = sorted(timing['seconds'] for timing in self.batch_timings)
+            return {
+                'model': self.model_name,
+                'backend': self.backend,
+                'variant': self.variant,
+                'batch_size': self.batch_size,
+                'num_processes': self.num_processes,
+                'total_chunks': self.total_chunks,
+                'total_seconds': round(self.total_seconds, 4),
+                'chunks_per_second': round(self.total_chunks / self.total_seconds, 2) if self.total_seconds else 0.0,
+                'batches': len(timings),
+                'batch_seconds_p50': timings[len(timings) // 2] if timings else 0.0,
+                'batch_seconds_max': timings[-1] if timings else 0.0,
+                'last_batches': list(self.batch_timings)[-5:]
+            }
+
+
+class RAGService:
+    def __init__(self, embedding_model: str = "all-MiniLM-L6-v2", embedding_cache_path: str = "./embedding_cache/embeddings.sqlite",
+                 embedding_batch_size: int = None, embedding_processes: int = None, embedding_backend: str = None):
+        # The embedding model and the cache are process-wide, shared with any
+        # other RAGService of this process
+        self.embedding_model = embedding_model
+        self.embedding_engine = resources.embedding_engine(
+            embedding_model,
+            batch_size=embedding_batch_size or int(os.environ.get("EMBEDDING_BATCH_SIZE", 64)),
+            num_processes=embedding_processes if embedding_processes is not None else int(os.environ.get("EMBEDDING_PROCESSES", 0)),
+            backend=embedding_backend or os.environ.get("EMBEDDING_BACKEND", "torch")
+        )
+        
+        # Chunks are measured in tokens of the embedding model's tokenizer and
+        # sized to its sequence limit, so no part of a chunk is truncated
+        # away at embedding time (CHUNK_UNIT=chars: 1000/200 characters)
+        self.chunk_unit = os.environ.get("CHUNK_UNIT", "tokens")
+        if self.chunk_unit == "tokens":
+            self.chunk_tokenizer = embedding_model
+            # [CLS] and [SEP] take two positions of the sequence
+            chunk_tokens = int(os.environ.get("CHUNK_TOKENS", 0)) or self.embedding_engine.max_seq_length - 2
+            self.text_splitter = make_text_splitter(chunk_tokens, int(os.environ.get("CHUNK_OVERLAP_TOKENS", 32)),
+                                                    self.chunk_tokenizer)
+        elif self.chunk_unit == "chars":
+            self.chunk_tokenizer = None
+            self.text_splitter = make_text_splitter(1000, 200)
+        else:
+            raise ValueError(f"Unknown chunk unit: {self.chunk_unit}")
+        
+        # Persistent embedding cache, so chunks that were already embedded
+        # with the same model and splitter settings are never sent to the
+        # model again
+        self.embedding_cache = resources.embedding_cache(embedding_cache_path)
+        self.embeddings = CachedEmbeddings(
+            self.embedding_engine,
+            self.embedding_cache,
+            namespace=f"{embedding_model}|{self.embedding_engine.variant}|{self.text_splitter._chunk_size}|{self.text_splitter._chunk_overlap}|{self.chunk_unit}"
+        )
+        
+        # One long-lived Chroma client; every document gets its own collection
+        # keyed by content hash, so documents never overwrite each other and
+        # already indexed documents are reused as-is
+        self.persist_directory = "./chroma_db"
+        self.chroma_client = resources.chroma_client(self.persist_directory)
+        # Eviction never drops a document under one of its writers
+        self.registry = DocumentRegistry(
+            self.chroma_client,
+            lock_document=lambda document_id: self._write_lock(document_id, blocking=False)
+        )
+        
+        # Retrieval strategy used to pick context chunks (see get_context_documents)
+        self.retrieval_strategy = os.environ.get("RETRIEVAL_STRATEGY", "mmr")
+        self.mmr_lambda = 0.3
+        
+        # Boilerplate removal at ingest: running headers/footers are stripped
+        # per page and near-duplicate chunks (SimHash) are not embedded
+        self.chunk_dedup = os.environ.get("CHUNK_DEDUP", "1").lower() not in ("0", "false", "no", "off")
+        
+        # Raw texts up to this many (estimated) tokens skip embedding and
+        # indexing and go whole into the prompt
+        self.chars_per_token = 4.0
+        self.small_document_tokens = int(os.environ.get("SMALL_DOCUMENT_TOKENS", 3000))
+        
+        # Indexes are shared read-only between requests, each request works
+        # on its own DocumentSession; writes to a document's index are
+        # serialized per document (see _write_lock)
+        self._write_locks = {}
+        self._write_locks_guard = threading.Lock()
+        
+        # Append-only history of processed documents
+        self.metadata_store = resources.metadata_store()
+        
+        # Page-parallel PDF text extraction, with extracted pages cached by content
+        self.pdf_extractor = resources.pdf_extractor()
+
+    @contextmanager
+    def _write_lock(self, document_id: str, blocking: bool = True):
+        """Serialize index writes for one document across threads and, through
+        a lock file, across worker processes sharing ./chroma_db. Yields
+        whether the lock is held: without blocking, False when it is taken"""
+        with self._write_locks_guard:
+            lock = self._write_locks.setdefault(document_id, threading.Lock())
+        if not lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            lock_directory = os.path.join(self.persist_directory, "locks")
+            os.makedirs(lock_directory, exist_ok=True)
+            with open(os.path.join(lock_directory, f"{self.registry.collection_name(document_id)}.lock"), "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock.release()
+
+    def _vector_store(self, collection_name: str) -> "Chroma":
+        """LangChain view over a collection of the shared Chroma client"""
+        from langchain_community.vectorstores import Chroma
+        return Chroma(
+            client=self.chroma_client,
+            collection_name=collection_name,
+            embedding_function=self.embeddings
+        )
+
+    def load_document(self, document_id: str) -> Optional[DocumentSession]:
+        """Open a session on an already indexed document, None if it is unknown or expired.
+        The document is not evicted until the session is closed"""
+        entry = self.registry.get(document_id, pin=True)
+        if entry is None:
+            return None
+        return self._pinned_session(document_id, entry['metadata'], self._vector_store(entry['collection_name']),
+                                    entry['lease'])
+
+    def _pinned_session(self, document_id: str, metadata: Dict, vector_store: "Chroma", lease: str) -> DocumentSession:
+        """Session on an indexed document already pinned in the registry, closing it unpins it once"""
+        released = threading.Lock()
+        
+        def release():
+            if released.acquire(blocking=False):
+                self.registry.unpin(lease)
+        
+        return DocumentSession.create(document_id, metadata, vector_store, release=release)
 
-        # Dereference vector store
-        self.vector_store = None
+    def is_indexed(self, document_id: str) -> bool:
+        """Whether a document is registered and its ingestion completed"""
+        entry = self.registry.get(document_id)
+        return entry is not None and entry['metadata'].get('status', 'done') == 'done'
 
-        # Try to reset the Chroma DB client
+    def _index_documents(self, document_id: str, documents: List[Document], metadata: Dict,
+                         progress_callback: Optional[Callable[[int], None]] = None, batch_size: int = 64) -> "Chroma":
+        """Embed documents into the collection of a document, register it and return its vector store.
+        progress_callback receives the number of chunks embedded so far"""
+        collection_name = self.registry.collection_name(document_id)
         try:
-            client = PersistentClient(persist_directory="./chroma_db")
-            client.reset()  # This clears collections and releases locks
-            print("Chroma client reset successfully.")
+            vector_store = self._vector_store(collection_name)
+            for i in range(0, len(documents), batch_size):
+                with metrics.span("chroma_write"):
+                    vector_store.add_documents(documents[i:i + batch_size])
+                if progress_callback:
+                    progress_callback(min(i + batch_size, len(documents)))
         except Exception as e:
-            print(f"Warning: Error resetting Chroma client: {e}")
+            # If there's an error, drop the partial collection and re-raise
+            self.registry.drop_collection(collection_name)
+            raise Exception(f"Error creating vector store: {str(e)}")
+        
+        self.registry.register(document_id, metadata, self._estimate_size(documents))
+        return vector_store
 
-        # Retry deletion
-        for i in range(5):
-            try:
-                if os.path.exists("./chroma_db"):
-                    shutil.rmtree("./chroma_db")
-                    print("Deleted chroma_db folder.")
-                    break
-            except Exception as e:
-                print(f"Warning: Attempt {i+1} - Error deleting chroma_db: {str(e)}")
-                time.sleep(1)
-
-
-    def process_pdf(self, pdf_path: str) -> None:
-        """Process a PDF file and create vector embeddings"""
-        # Load PDF
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-
-        # Generate a unique collection name based on timestamp
-        collection_name = f"pdf_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # Clean up existing vector store
-        self.cleanup_vector_store()
-        
-        # Create metadata
-        self.current_document_metadata = {
-            'filename': os.path.basename(pdf_path),
+    def _estimate_size(self, documents: List[Document]) -> int:
+        """Rough on-disk footprint of indexed chunks: text plus float32 vectors"""
+        dimension = self.embedding_engine.dimension
+        return sum(len(doc.page_content.encode("utf-8")) + dimension * 4 for doc in documents)
+
+    def _pdf_metadata(self, document_id: str, filename: str, total_pages: int, total_chunks: int) -> Dict:
+        return {
+            'document_id': document_id,
+            'filename': filename,
             'processed_date': datetime.now().isoformat(),
-            'total_pages': len(pages),
-            'total_chunks': 0,
+            'total_pages': total_pages,
+            'total_chunks': total_chunks,
             'chunk_size': self.text_splitter._chunk_size,
             'chunk_overlap': self.text_splitter._chunk_overlap,
-            'collection_name': collection_name
+            'chunk_unit': self.chunk_unit,
+            'collection_name': self.registry.collection_name(document_id)
         }
+
+    def load_and_split_pdf(self, pdf_path: str) -> Tuple[int, List[Document]]:
+        """Load a PDF and split it into chunks, returns (total_pages, chunks)"""
+        return load_and_split_pdf(pdf_path, self.text_splitter._chunk_size, self.text_splitter._chunk_overlap, self.chunk_dedup,
+                                  self.chunk_tokenizer)
+
+    def _load_indexed(self, document_id: str) -> Optional[DocumentSession]:
+        """Session on a document whose ingestion completed; under the write
+        lock, an entry still marked 'ingesting', or a collection without
+        entry, was left by a crashed writer and is dropped before re-ingesting"""
+        session = self.load_document(document_id)
+        if session is None:
+            # Written before its first register(), the chunks would otherwise be stored twice
+            if self.registry.drop_orphan_collection(document_id):
+                print(f"Document {document_id[:12]} left partially ingested, dropped its unregistered collection")
+            return None
+        if session.metadata.get('status', 'done') != 'done':
+            print(f"Document {document_id[:12]} left partially ingested, dropping it before re-ingesting")
+            session.close()
+            self.registry.remove(document_id)
+            return None
+        return session
+
+    def index_pdf_documents(self, document_id: str, filename: str, total_pages: int, documents: List[Document],
+                            progress_callback: Optional[Callable[[int], None]] = None) -> DocumentSession:
+        """Index the chunks of an already split PDF, returns a session on it"""
+        with self._write_lock(document_id):
+            session = self._load_indexed(document_id)
+            if session is not None:
+                return session
+            
+            # Create metadata
+            metadata = self._pdf_metadata(document_id, filename, total_pages, len(documents))
+            
+            vector_store = self._index_documents(document_id, documents, metadata, progress_callback)
+            lease = self.registry.pin(document_id)
         
-        # Split text into chunks
-        self.documents = self.text_splitter.split_documents(pages)
-        self.current_document_metadata['total_chunks'] = len(self.documents)
+        # Save metadata
+        self.save_metadata(metadata)
+        return self._pinned_session(document_id, metadata, vector_store, lease)
+
+    def process_pdf(self, pdf_path: str, window_pages: int = 16, document_id: Optional[str] = None,
+                    filename: Optional[str] = None) -> DocumentSession:
+        """Process a PDF file and create vector embeddings, returns a session on it.
+        
+        Pages are read lazily and split, embedded and upserted window_pages at
+        a time, so memory stays bounded by the window and the first chunks are
+        queryable (through the registry) before the whole file is ingested.
+        Concurrent uploads of the same file wait for the first one and reuse its index.
+        document_id (the content hash) is computed from the file unless given.
+        The session keeps the document from being evicted until it is closed"""
+        document_id = document_id or self.registry.hash_file(pdf_path)
+        with self._write_lock(document_id):
+            session = self._load_indexed(document_id)
+            if session is not None:
+                print(f"Document {document_id[:12]} already indexed, skipping ingestion")
+                return session
+            metadata, vector_store = self._ingest_pdf(document_id, pdf_path, window_pages, filename)
+            lease = self.registry.pin(document_id)
+        
+        # Save metadata
+        self.save_metadata(metadata)
+        return self._pinned_session(document_id, metadata, vector_store, lease)
+
+    def _ingest_pdf(self, document_id: str, pdf_path: str, window_pages: int,
+                    filename: Optional[str] = None) -> Tuple[Dict, "Chroma"]:
+        """Stream the pages of a PDF into its collection, returns (metadata, vector_store)"""
+        metadata = self._pdf_metadata(document_id, filename or os.path.basename(pdf_path), 0, 0)
+        metadata['status'] = 'ingesting'
+        metadata['duplicate_chunks'] = 0
+        vector_store = self._vector_store(metadata['collection_name'])
+        # Shared across windows: boilerplate chunks repeat throughout the file
+        duplicate_filter = NearDuplicateFilter() if self.chunk_dedup else None
+        # Headers and footers are detected once, on the first pages (the
+        # first window waits for them), and stripped from every window
+        boilerplate = None
         
+        size_bytes = 0
+        window = []
         try:
-            # Create vector store with unique collection name
-            self.vector_store = Chroma.from_documents(
-                documents=self.documents,
-                embedding=self.embeddings,
-                collection_name=collection_name,
-                persist_directory="./chroma_db"
-            )
-            
-            # Save metadata
-            self.save_metadata(self.current_document_metadata)
+            for page in metrics.timed_iter(self.pdf_extractor.lazy_extract(pdf_path), "pdf_load"):
+                window.append(page)
+                if len(window) >= window_pages and (boilerplate is not None or len(window) >= BOILERPLATE_SAMPLE_PAGES):
+                    if boilerplate is None:
+                        boilerplate = self._detect_boilerplate(window)
+                    size_bytes += self._ingest_window(vector_store, window, metadata, duplicate_filter, boilerplate)
+                    self.registry.register(document_id, metadata, size_bytes)
+                    window = []
+            if window:
+                if boilerplate is None:
+                    boilerplate = self._detect_boilerplate(window)
+                size_bytes += self._ingest_window(vector_store, window, metadata, duplicate_filter, boilerplate)
         except Exception as e:
-            # If there's an error, clean up and re-raise
-            self.cleanup_vector_store()
+            # If there's an error, drop the partial document and re-raise
+            self.registry.remove(document_id)
             raise Exception(f"Error creating vector store: {str(e)}")
+        
+        metadata['status'] = 'done'
+        self.registry.register(document_id, metadata, size_bytes)
+        return metadata, vector_store
+
+    def _detect_boilerplate(self, pages: List[Document]) -> Set[str]:
+        if not self.chunk_dedup:
+            return set()
+        with metrics.span("dedup"):
+            return detect_headers_footers(pages[:BOILERPLATE_SAMPLE_PAGES])
+
+    def _ingest_window(self, vector_store: "Chroma", pages: List[Document], metadata: Dict,
+                       duplicate_filter: Optional[NearDuplicateFilter] = None, boilerplate: Optional[Set[str]] = None) -> int:
+        """Split, embed and upsert a window of pages, returns its estimated size in bytes;
+        with a duplicate_filter, the boilerplate lines of the document are stripped first"""
+        if duplicate_filter is not None:
+            with metrics.span("dedup"):
+                pages = strip_headers_footers(pages, boilerplate or set())
+        with metrics.span("split"):
+            chunks = self.text_splitter.split_documents(pages)
+        if duplicate_filter is not None:
+            chunks = self._drop_duplicate_chunks(chunks, duplicate_filter, metadata)
+        if chunks:
+            with metrics.span("chroma_write"):
+                vector_store.add_documents(chunks)
+        metadata['total_pages'] += len(pages)
+        metadata['total_chunks'] += len(chunks)
+        print(f"Ingested {metadata['total_pages']} pages ({metadata['total_chunks']} chunks) of {metadata['filename']}")
+        return self._estimate_size(chunks)
+
+    @staticmethod
+    def _drop_duplicate_chunks(chunks: List[Document], duplicate_filter: NearDuplicateFilter, metadata: Dict) -> List[Document]:
+        with metrics.span("dedup"):
+            kept = duplicate_filter.filter(chunks)
+        dropped = len(chunks) - len(kept)
+        metadata['duplicate_chunks'] += dropped
+        metrics.inc("qcm_chunks_dropped_total", dropped, labels={'reason': 'near_duplicate'})
+        return kept
 
-    def process_text(self, text: str) -> None:
-        """Process raw text and create vector embeddings"""
-        # Create metadata
-        self.current_document_metadata = {
+    def process_text(self, text: str) -> DocumentSession:
+        """Prepare raw text for question generation, returns a session on it.
+        
+        Raw text is a one-off input and is never written to ./chroma_db: up to
+        small_document_tokens it is put whole in the prompt (no embedding, no
+        index), above that it is split and indexed in memory for the duration
+        of the request. Close the session (or use it as a context manager) to
+        free that index"""
+        return self._text_session(*self._split_text(text))
+
+    def process_texts(self, texts: List[str]) -> List[DocumentSession]:
+        """Like process_text for several texts, with the chunks of all of them
+        embedded together so the model sees full batches across documents"""
+        prepared = [self._split_text(text) for text in texts]
+        chunks = [doc.page_content for _, metadata, documents in prepared if metadata['index'] == 'ephemeral'
+                  for doc in documents]
+        if chunks:
+            # Each index then reads its vectors back from the embedding cache
+            self.embeddings.embed_documents(chunks)
+        
+        sessions = []
+        try:
+            for prepared_text in prepared:
+                sessions.append(self._text_session(*prepared_text))
+        except Exception:
+            for session in sessions:
+                session.close()
+            raise
+        return sessions
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def _split_text(self, text: str) -> Tuple[str, Dict, List[Document]]:
+        """Returns (document_id, metadata, chunks); a text small enough to go inline is a single chunk"""
+        document_id = self.registry.hash_text(text)
+        metadata = {
+            'document_id': document_id,
             'processed_date': datetime.now().isoformat(),
             'total_chunks': 0,
             'chunk_size': self.text_splitter._chunk_size,
-            'chunk_overlap': self.text_splitter._chunk_overlap
+            'chunk_overlap': self.text_splitter._chunk_overlap,
+            'chunk_unit': self.chunk_unit,
+            'estimated_tokens': self.estimate_tokens(text)
         }
         
-        # Split text into chunks
-        self.documents = self.text_splitter.split_text(text)
-        self.current_document_metadata['total_chunks'] = len(self.documents)
-        
-        # Create vector store
-        self.vector_store = Chroma.from_texts(
-            texts=self.documents,
-            embedding=self.embeddings,
-            persist_directory="./chroma_db"
-        )
+        if metadata['estimated_tokens'] <= self.small_document_tokens:
+            metadata['index'] = 'inline'
+            metadata['total_chunks'] = 1
+            return document_id, metadata, [Document(page_content=text, metadata={'start_index': 0})]
         
-        # Save metadata
-        self.save_metadata(self.current_document_metadata)
+        metadata['index'] = 'ephemeral'
+        # Split text into chunks
+        with metrics.span("split"):
+            documents = self.text_splitter.create_documents([text])
+        if self.chunk_dedup:
+            metadata['duplicate_chunks'] = 0
+            documents = self._drop_duplicate_chunks(documents, NearDuplicateFilter(), metadata)
+        metadata['total_chunks'] = len(documents)
+        return document_id, metadata, documents
 
-    def get_relevant_chunks(self, query: str, k: int = 3) -> List[str]:
-        """Retrieve the most relevant text chunks for a given query"""
-        if not self.vector_store:
-            raise ValueError("No documents have been processed yet")
+    def _text_session(self, document_id: str, metadata: Dict, documents: List[Document]) -> DocumentSession:
+        """Session on a split text: inline, or indexed in an in-memory collection owned by the session"""
+        metrics.inc("qcm_text_ingest_total", labels={'index': metadata['index']})
+        if metadata['index'] == 'inline':
+            return DocumentSession.create(document_id, metadata, None, documents=documents)
         
+        # One collection per request: the same text sent twice at the same
+        # time gets two independent indexes
+        client = resources.ephemeral_chroma_client()
+        collection_name = f"tmp_{document_id[:24]}_{uuid.uuid4().hex[:8]}"
+        metadata['collection_name'] = collection_name
+        
+        def release():
+            try:
+                client.delete_collection(collection_name)
+            except Exception:
+                pass  # Already released
+        
+        from langchain_community.vectorstores import Chroma
+        vector_store = Chroma(client=client, collection_name=collection_name, embedding_function=self.embeddings)
+        try:
+            with metrics.span("chroma_write"):
+                vector_store.add_documents(documents)
+        except Exception as e:
+            release()
+            raise Exception(f"Error creating vector store: {str(e)}")
+        return DocumentSession.create(document_id, metadata, vector_store, release=release)
+
+    def get_relevant_chunks(self, session: DocumentSession, query: str, k: int = 3) -> List[str]:
+        """Retrieve the most relevant text chunks of the session's document for a given query"""
+        if session.vector_store is None:
+            # Small text: the whole document is the context
+            return [doc.page_content for doc in session.documents]
         # Search for relevant chunks
-        docs = self.vector_store.similarity_search(query, k=k)
+        with metrics.span("similarity_search"):
+            docs = session.vector_store.similarity_search(query, k=k)
         return [doc.page_content for doc in docs]
 
-    def get_context_for_question(self, question_type: str, num_questions: int) -> List[str]:
+    def get_context_for_question(self, session: DocumentSession, question_type: str, num_questions: int,
+                                 strategy: Optional[str] = None) -> List[str]:
         """Get relevant context for generating questions"""
-        if not self.vector_store:
-            raise ValueError("No documents have been processed yet")
+        return [doc.page_content for doc in self.get_context_documents(session, question_type, num_questions, strategy)]
+
+    def get_context_documents(self, session: DocumentSession, question_type: str, num_questions: int,
+                              strategy: Optional[str] = None) -> List[Document]:
+        """Get relevant context chunks, with their page and position metadata, for generating questions.
+        
+        strategy (defaults to self.retrieval_strategy) is one of:
+        - "similarity": top-k nearest chunks to the question type query
+        - "mmr": max-marginal-relevance, relevant to the query but diverse
+        - "kmeans": one representative chunk per k-means cluster
+        - "stratified": MMR spread evenly across the page ranges"""
+        strategy = strategy or self.retrieval_strategy
+        if session.vector_store is None:
+            # Small text: the whole document is the context
+            return list(session.documents)
         
         # Create a query based on question type
         if question_type == "open":
@@ -141,52 +639,52 @@ class RAGService:
         else:  # yes/no questions
             query = "Find sections that contain factual statements or clear assertions"
         
-        # Get relevant chunks
-        chunks = self.get_relevant_chunks(query, k=num_questions)
-        return chunks
-
-    def save_metadata(self, metadata: Dict) -> None:
-        """Save metadata about the processed document"""
-        os.makedirs("./metadata", exist_ok=True)
-        metadata_file = "./metadata/document_metadata.json"
-        
-        # Load existing metadata if it exists
-        existing_metadata = {}
-        if os.path.exists(metadata_file):
-            try:
-                with open(metadata_file, "r") as f:
-                    existing_metadata = json.load(f)
-            except json.JSONDecodeError:
-                existing_metadata = {}
+        if strategy == "similarity":
+            # Get relevant chunks
+            with metrics.span("similarity_search"):
+                return session.vector_store.similarity_search(query, k=num_questions)
         
-        # Update metadata
-        if not isinstance(existing_metadata, list):
-            existing_metadata = []
+        # Coverage-oriented strategies select among the persisted chunk
+        # embeddings, with no extra embedding calls (the query vector comes
+        # from the embedding cache after its first use)
+        with metrics.span("chroma_read"):
+            stored = session.vector_store._collection.get(include=["embeddings", "documents", "metadatas"])
+        texts = stored["documents"]
+        if not texts:
+            return []
+        vectors = np.asarray(stored["embeddings"], dtype=np.float32)
         
-        existing_metadata.append(metadata)
+        with metrics.span("retrieval_select"):
+            if strategy == "mmr":
+                query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+                picked = mmr_select(vectors, num_questions, query=query_vector, lambda_mult=self.mmr_lambda)
+            elif strategy == "kmeans":
+                picked = kmeans_select(vectors, num_questions)
+            elif strategy == "stratified":
+                query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+                pages = [(metadata or {}).get("page", 0) for metadata in stored["metadatas"]]
+                picked = page_stratified_select(vectors, pages, num_questions, query=query_vector, lambda_mult=self.mmr_lambda)
+            else:
+                raise ValueError(f"Unknown retrieval strategy: {strategy}")
         
-        # Save updated metadata
-        with open(metadata_file, "w") as f:
-            json.dump(existing_metadata, f, indent=2)
+        # Keep document order, so the prompt reads like the source
+        metadatas = stored["metadatas"] or [None] * len(texts)
+        return [Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in sorted(picked)]
 
-    def load_metadata(self) -> List[Dict]:
-        """Load metadata about all processed documents"""
-        try:
-            with open("./metadata/document_metadata.json", "r") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
-        except json.JSONDecodeError:
-            return []
+    def save_metadata(self, metadata: Dict) -> None:
+        """Save metadata about the processed document"""
+        with metrics.span("metadata_write"):
+            self.metadata_store.append(metadata)
 
-    def get_document_stats(self) -> Dict:
-        """Get statistics about the current document"""
-        if not self.current_document_metadata:
-            return {}
-        
-        return {
-            'total_chunks': self.current_document_metadata.get('total_chunks', 0),
-            'chunk_size': self.current_document_metadata.get('chunk_size', 0),
-            'chunk_overlap': self.current_document_metadata.get('chunk_overlap', 0),
-            'processed_date': self.current_document_metadata.get('processed_date', '')
-        } 
\ No newline at end of file
+    def load_metadata(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """Load metadata about processed documents, most recent first"""
+        entries, _ = self.metadata_store.list_entries(offset, limit)
+        return entries
+
+    def get_embedding_cache_stats(self) -> Dict:
+        """Get hit/miss statistics of the embedding cache"""
+        return self.embedding_cache.stats()
+
+    def get_embedding_stats(self) -> Dict:
+        """Get throughput and per-batch timing metrics of the embedding engine"""
+        return self.embedding_engine.stats()
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+from .metrics import metrics
+
+# Reference point of the startup breakdown: when this process imported the service package
+SERVICE_IMPORTED = time.perf_counter()
+
+
+class ResourceManager:
+    """
+    Process-wide registry of heavyweight objects (Chroma client, embedding
+    model, caches). Each resource is built once, on first use, and shared by
+    every request thread; the time spent building each one is recorded as
+    the startup breakdown
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._building = {}
+        self.timings = {}
+        self.warmed_up = False
+
+    def get(self, key: Hashable, factory: Callable, label: Optional[str] = None):
+        """Return the resource stored under key, building it with factory the first time"""
+        with self._lock:
+            if key in self._resources:
+                return self._resources[key]
+            # One lock per resource: slow builds (e.g. the model) don't block the others
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                if key in self._resources:
+                    return self._resources[key]
+            start = time.perf_counter()
+            resource = factory()
+            self.record(label or str(key), time.perf_counter() - start)
+            with self._lock:
+                self._resources[key] = resource
+        return resource
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add a stage to the startup breakdown"""
+        with self._lock:
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 4)
+        metrics.observe("qcm_startup_seconds", seconds, labels={'stage': stage})
+
+    def chroma_client(self, path: str = "./chroma_db"):
+        """The single persistent Chroma client of this process for path"""
+        def build():
+            from chromadb import PersistentClient
+            return PersistentClient(path=path)
+        return self.get(('chroma_client', os.path.abspath(path)), build, "chroma_client")
+
+    def ephemeral_chroma_client(self):
+        """In-memory Chroma client holding the per-request indexes of one-off texts"""
+        def build():
+            from chromadb import EphemeralClient
+            return EphemeralClient()
+        return self.get(('ephemeral_chroma_client',), build, "ephemeral_chroma_client")
+
+    def embedding_engine(self, model_name: str, batch_size: int, num_processes: int, backend: str):
+        """The shared embedding model for the given settings"""
+        def build():
+            from .rag_service import EmbeddingEngine
+            return EmbeddingEngine(model_name, batch_size=batch_size, num_processes=num_processes, backend=backend)
+        return self.get(('embedding_engine', model_name, batch_size, num_processes, backend), build,
+                        f"embedding_model:{model_name}:{backend}")
+
+    def tokenizer(self, model_name: str):
+        """Hugging Face tokenizer of a sentence-transformers model, used to measure chunks in tokens"""
+        def build():
+            from transformers import AutoTokenizer
+            # Bare sentence-transformers names (all-MiniLM-L6-v2) live under that organisation on the Hub
+            return AutoTokenizer.from_pretrained(model_name if "/" in model_name else f"sentence-transformers/{model_name}")
+        return self.get(('tokenizer', model_name), build, f"tokenizer:{model_name}")
+
+    def embedding_cache(self, cache_path: str):
+        def build():
+            from .embedding_cache import EmbeddingCache
+            return EmbeddingCache(cache_path)
+        return self.get(('embedding_cache', os.path.abspath(cache_path)), build, "embedding_cache")
+
+    def pdf_extractor(self, cache_path: str = "./pdf_cache/pages.sqlite", max_processes: Optional[int] = None):
+        """PDF extractor of this process, with its page text cache and process pool"""
+        def build():
+            from .pdf_extraction import PageTextCache, PdfExtractor
+            return PdfExtractor(PageTextCache(cache_path), max_processes=max_processes)
+        return self.get(('pdf_extractor', os.path.abspath(cache_path), max_processes), build, "pdf_extractor")
+
+    def metadata_store(self, db_path: str = "./metadata/document_metadata.sqlite"):
+        def build():
+            from .metadata_store import MetadataStore
+            return MetadataStore(db_path)
+        return self.get(('metadata_store', os.path.abspath(db_path)), build, "metadata_store")
+
+    def warm_up(self, embedding_engine) -> None:
+        """Run the embedding model once so the first request doesn't pay for lazy initialisation"""
+        start = time.perf_counter()
+        embedding_engine.embed_query("warm-up")
+        self.record("embedding_warm_up", time.perf_counter() - start)
+        self.warmed_up = True
+
+    def startup_report(self) -> Dict:
+        """Time spent building each resource, and since the service package was imported"""
+        with self._lock:
+            return {
+                'seconds_since_import': round(time.perf_counter() - SERVICE_IMPORTED, 4),
+                'warmed_up': self.warmed_up,
+                'resources': sorted(str(key[0]) for key in self._resources),
+                'stages': dict(self.timings),
+                'total_seconds': round(sum(self.timings.values()), 4)
+            }
+
+
+# Process-wide instance shared by RAGService, QCMGenerator and app.py
+resources = ResourceManager()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .metrics import metrics
+
+
+class MemoryCacheBackend:
+    """In-process LRU backend"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: List[Dict], ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """On-disk sqlite backend, shared by every worker process on the host"""
+
+    def __init__(self, cache_path: str = "./result_cache/results.sqlite"):
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: List[Dict], ttl_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl_seconds)
+            )
+            self._conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        return count
+
+
+class ResultCache:
+    """Cache of generated question sets, keyed by document, question type and count, model and prompt version"""
+
+    def __init__(self, backend=None, ttl_seconds: float = 24 * 3600):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """Build the cache from RESULT_CACHE_BACKEND (memory or disk) and RESULT_CACHE_TTL (seconds)"""
+        backend_name = os.environ.get("RESULT_CACHE_BACKEND", "memory")
+        if backend_name == "disk":
+            backend = DiskCacheBackend()
+        elif backend_name == "memory":
+            backend = MemoryCacheBackend()
+        else:
+            raise ValueError(f"Unknown result cache backend: {backend_name}")
+        return cls(backend, ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", 24 * 3600)))
+
+    @staticmethod
+    def make_key(document_id: str, question_type: str, num_questions: int, model: str, prompt_version: str) -> str:
+        raw = json.dumps([document_id, question_type, num_questions, model, prompt_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            metrics.inc("qcm_cache_lookups_total", labels={'cache': 'result', 'result': 'miss'})
+            return None
+        self.hits += 1
+        metrics.inc("qcm_cache_lookups_total", labels={'cache': 'result', 'result': 'hit'})
+        # Copies, so callers can annotate questions without touching the cache
+        return [dict(question) for question in value]
+
+    def set(self, key: str, questions: List[Dict]) -> None:
+        # Failed or empty generations are never cached
+        if questions:
+            self.backend.set(key, [dict(question) for question in questions], self.ttl_seconds)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
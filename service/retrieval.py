@@ -0,0 +1,103 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(embeddings: np.ndarray, k: int, query: Optional[np.ndarray] = None,
+               lambda_mult: float = 0.5, candidates: Optional[Sequence[int]] = None,
+               selected: Optional[List[int]] = None) -> List[int]:
+    """
+    Max-marginal-relevance selection of k rows of embeddings: each step picks
+    the chunk most relevant to the query (the document centroid if no query
+    is given) that is least similar to the chunks already selected
+    """
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    target = _normalize(np.asarray(query, dtype=np.float32)) if query is not None else _normalize(vectors.mean(axis=0))
+    relevance = vectors @ target
+
+    candidate_mask = np.zeros(len(vectors), dtype=bool)
+    candidate_mask[list(candidates) if candidates is not None else slice(None)] = True
+    selected = list(selected or [])
+    candidate_mask[selected] = False
+
+    # Running max similarity of every chunk to the selected set
+    redundancy = np.full(len(vectors), -1.0, dtype=np.float32)
+    if selected:
+        redundancy = (vectors @ vectors[selected].T).max(axis=1)
+
+    picked = []
+    while len(picked) < k and candidate_mask.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.maximum(redundancy, 0.0)
+        scores[~candidate_mask] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        candidate_mask[best] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return picked
+
+
+def kmeans_select(embeddings: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> List[int]:
+    """
+    Cluster the embeddings into k groups (cosine k-means) and return, for
+    each cluster, the chunk closest to its centroid
+    """
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    k = min(k, len(vectors))
+    if k == 0:
+        return []
+
+    # k-means++ style seeding: spread initial centroids out
+    rng = np.random.default_rng(seed)
+    centroid_ids = [int(rng.integers(len(vectors)))]
+    for _ in range(1, k):
+        distance = 1.0 - (vectors @ vectors[centroid_ids].T).max(axis=1)
+        distance = np.maximum(distance, 0.0)
+        total = distance.sum()
+        if total <= 0:
+            break
+        centroid_ids.append(int(rng.choice(len(vectors), p=distance / total)))
+    centroids = vectors[centroid_ids]
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        updated = np.stack([
+            vectors[assignment == c].mean(axis=0) if np.any(assignment == c) else centroids[c]
+            for c in range(len(centroids))
+        ])
+        updated = _normalize(updated)
+        if np.allclose(updated, centroids, atol=1e-5):
+            break
+        centroids = updated
+
+    similarity = vectors @ centroids.T
+    picked = []
+    for c in range(len(centroids)):
+        order = np.argsort(-similarity[:, c])
+        best = next((int(i) for i in order if int(i) not in picked), None)
+        if best is not None:
+            picked.append(best)
+    return picked
+
+
+def page_stratified_select(embeddings: np.ndarray, pages: Sequence[int], k: int,
+                           query: Optional[np.ndarray] = None, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Spread k picks evenly across the document: pages are split into k
+    contiguous ranges and MMR picks one chunk per range, then fills any
+    remaining slots from the whole document
+    """
+    pages = np.asarray(pages)
+    strata = [s for s in np.array_split(np.unique(pages), min(k, len(np.unique(pages)))) if len(s)]
+    picked = []
+    for stratum in strata:
+        candidates = np.flatnonzero(np.isin(pages, stratum))
+        picked += mmr_select(embeddings, 1, query=query, lambda_mult=lambda_mult,
+                             candidates=candidates, selected=picked)
+    if len(picked) < k:
+        picked += mmr_select(embeddings, k - len(picked), query=query, lambda_mult=lambda_mult, selected=picked)
+    return picked[:k]
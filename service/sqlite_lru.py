@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+from .metrics import metrics
+
+
+class SqliteLRUCache:
+    """
+    Persistent, size-bounded LRU cache stored in one sqlite table
+    (key, <value_column>, last_access). Subclasses name the table and the
+    value column, and convert values to and from what sqlite stores
+    """
+
+    table = "entries"
+    value_column = "value"
+    value_type = "BLOB"
+    # Label of the lookups in qcm_cache_lookups_total
+    metrics_label = "sqlite"
+
+    def __init__(self, cache_path: str, max_entries: int):
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            " key TEXT PRIMARY KEY,"
+            f" {self.value_column} {self.value_type} NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_access ON {self.table} (last_access)")
+        self._conn.commit()
+
+    def _encode(self, value: Any) -> Any:
+        return value
+
+    def _decode(self, stored: Any) -> Any:
+        return stored
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Return the cached values for the given keys, refreshing their LRU position"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            # sqlite limits the number of bound parameters per statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, {self.value_column} FROM {self.table} WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, stored in rows:
+                    found[key] = self._decode(stored)
+                if rows:
+                    self._conn.executemany(
+                        f"UPDATE {self.table} SET last_access = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows]
+                    )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        metrics.inc("qcm_cache_lookups_total", len(found), labels={'cache': self.metrics_label, 'result': 'hit'})
+        metrics.inc("qcm_cache_lookups_total", len(set(keys)) - len(found),
+                    labels={'cache': self.metrics_label, 'result': 'miss'})
+        return found
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        """Store values and evict the least recently used entries above the size bound"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, {self.value_column}, last_access) VALUES (?, ?, ?)",
+                [(key, self._encode(value), now) for key, value in items.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters and current size of the cache"""
+        with self._lock:
+            (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': count,
+            'max_entries': self.max_entries
+        }
@@ -0,0 +1,84 @@
+import json
+from typing import Dict, List
+
+
+class IncrementalQuestionParser:
+    """
+    Incremental parser for the {"questions": [...]} schema requested by the
+    prompts: text is fed as it streams in, and every question object is
+    returned as soon as its closing brace has been received
+    """
+
+    def __init__(self, array_key: str = "questions"):
+        self.array_key = array_key
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.item_start = None
+
+    def feed(self, text: str) -> List[Dict]:
+        """Consume a piece of the response and return the questions it completed"""
+        self.buffer += text
+        items = []
+
+        if not self.in_array and not self._find_array_start():
+            return items
+
+        while self.position < len(self.buffer) and not self.done:
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.item_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.item_start is not None:
+                    item = self._decode(self.buffer[self.item_start:self.position + 1])
+                    if item is not None:
+                        items.append(item)
+                    self.item_start = None
+            elif char == "]" and self.depth == 0:
+                self.done = True
+
+            self.position += 1
+
+        # Drop consumed text that no pending item refers to
+        if self.item_start is None:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+
+        return items
+
+    def _find_array_start(self) -> bool:
+        key_index = self.buffer.find(f'"{self.array_key}"')
+        if key_index < 0:
+            return False
+        bracket_index = self.buffer.find("[", key_index)
+        if bracket_index < 0:
+            return False
+        self.in_array = True
+        self.position = bracket_index + 1
+        return True
+
+    @staticmethod
+    def _decode(raw: str):
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing streamed question: {e}")
+            return None
+        return item if isinstance(item, dict) else None
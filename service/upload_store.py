@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from collections import Counter
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from .metrics import metrics
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    """An upload in the store: its sha256 (the document id), path and size"""
+
+    document_id: str
+    path: str
+    size_bytes: int
+    duplicate: bool
+
+
+class UploadStore:
+    """
+    Content-addressed upload storage: the request stream is hashed while it
+    is written to disk in chunks, then the file is moved to
+    <root>/<sha256><suffix>. The same content is stored once whatever its
+    name, same-named uploads never overwrite each other, and the hash is the
+    document id, so a known document is recognised before any parsing.
+    Files unused for max_age_seconds are removed, then the least recently
+    used ones until the store fits in max_bytes; pinned files (queued or
+    running ingestion jobs, PDFs being ingested by a request) are never removed
+    """
+
+    def __init__(self, root: str = "uploads", max_bytes: Optional[int] = None, max_age_seconds: Optional[float] = None,
+                 chunk_size: int = 1024 * 1024, min_age_seconds: float = 600.0, cleanup_interval: float = 60.0):
+        self.root = root
+        self.incoming = os.path.join(root, ".incoming")
+        os.makedirs(self.incoming, exist_ok=True)
+        self.max_bytes = max_bytes or int(os.environ.get("UPLOAD_MAX_BYTES", 2 * 1024 ** 3))
+        self.max_age_seconds = max_age_seconds or float(os.environ.get("UPLOAD_MAX_AGE_SECONDS", 7 * 24 * 3600))
+        self.chunk_size = chunk_size
+        # Recently used files may still be being ingested, the quota never evicts them
+        self.min_age_seconds = min_age_seconds
+        self.cleanup_interval = cleanup_interval
+
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._pinned = Counter()
+        self.uploads = 0
+        self.duplicates = 0
+
+    def save(self, stream: BinaryIO, suffix: str = ".pdf") -> StoredUpload:
+        """Write stream to the store, returns where its content lives"""
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.incoming, f"{uuid.uuid4().hex}.part")
+        try:
+            with metrics.span("upload_save"), open(temp_path, "wb") as f:
+                for block in iter(lambda: stream.read(self.chunk_size), b""):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            document_id = digest.hexdigest()
+            path = os.path.join(self.root, f"{document_id}{suffix}")
+
+            with self._lock:
+                self.uploads += 1
+                duplicate = os.path.exists(path)
+                if duplicate:
+                    self.duplicates += 1
+                    # Last use drives the age-based cleanup
+                    os.utime(path)
+                else:
+                    os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        metrics.inc("qcm_uploads_total", labels={'result': 'duplicate' if duplicate else 'new'})
+        if not duplicate:
+            self.maybe_cleanup()
+        return StoredUpload(document_id, path, size, duplicate)
+
+    def pin(self, path: str) -> None:
+        """Keep path out of the cleanup until unpin(path)"""
+        with self._lock:
+            self._pinned[os.path.abspath(path)] += 1
+
+    def unpin(self, path: str) -> None:
+        with self._lock:
+            path = os.path.abspath(path)
+            self._pinned[path] -= 1
+            if self._pinned[path] <= 0:
+                del self._pinned[path]
+
+    @contextmanager
+    def pinned(self, path: str) -> Iterator[str]:
+        """Keep path out of the cleanup for the duration of the block"""
+        self.pin(path)
+        try:
+            yield path
+        finally:
+            self.unpin(path)
+
+    def maybe_cleanup(self) -> None:
+        with self._lock:
+            if time.time() - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = time.time()
+        self.cleanup()
+
+    def cleanup(self) -> Dict:
+        """Remove expired files, then the least recently used ones above the quota"""
+        now = time.time()
+        removed = 0
+        freed = 0
+        files = []
+        with self._lock:
+            for directory in (self.root, self.incoming):
+                for entry in os.scandir(directory):
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    pinned = os.path.abspath(entry.path) in self._pinned
+                    # Partial writes are left behind by crashed uploads only
+                    max_age = 3600 if directory == self.incoming else self.max_age_seconds
+                    if now - stat.st_mtime > max_age and not pinned:
+                        if self._remove(entry.path):
+                            removed += 1
+                            freed += stat.st_size
+                    elif directory == self.root:
+                        files.append((stat.st_mtime, stat.st_size, entry.path, pinned))
+
+            # Pinned files count towards the quota but are never removed
+            total = sum(size for _, size, _, _ in files)
+            for mtime, size, path, pinned in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if pinned or now - mtime < self.min_age_seconds:
+                    continue
+                total -= size
+                if self._remove(path):
+                    removed += 1
+                    freed += size
+
+        if removed:
+            print(f"Upload cleanup removed {removed} files ({freed} bytes)")
+            metrics.inc("qcm_upload_files_removed_total", removed)
+        return {'removed': removed, 'freed_bytes': freed, 'total_bytes': total}
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            # Removed meanwhile by another worker process
+            return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'uploads': self.uploads,
+                'duplicates': self.duplicates,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age_seconds
+            }
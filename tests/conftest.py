@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Allow running the tests from the repository root without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
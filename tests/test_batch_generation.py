@@ -0,0 +1,70 @@
+import threading
+
+from langchain_core.documents import Document
+
+from benchmarks.corpus import synthetic_text
+from benchmarks.fake_llm import FakeGenaiClient
+from service.batch_generation import BatchGenerator
+from service.document_session import DocumentSession
+from service.llm_gimi import QCMGenerator
+from tests.test_qcm_generator import StubRAGService
+
+
+class StubTextRAGService(StubRAGService):
+    """Texts become inline sessions, without splitting or embedding"""
+
+    def __init__(self):
+        super().__init__()
+        self.released = 0
+        self.lock = threading.Lock()
+
+    def process_text(self, text):
+        return DocumentSession.create(None, {'index': 'inline'}, None, documents=[Document(page_content=text)],
+                                      release=self._release)
+
+    def _release(self):
+        with self.lock:
+            self.released += 1
+
+    def process_texts(self, texts):
+        return [self.process_text(text) for text in texts]
+
+
+def run_batch(client, items):
+    generator = QCMGenerator(client=client, rag_service=StubTextRAGService())
+    batch_generator = BatchGenerator(generator, max_workers=2)
+    items = batch_generator.validate(items)
+    return sorted(batch_generator.run(items, use_cache=False), key=lambda result: result['index'])
+
+
+def test_failed_generation_is_reported_as_an_error():
+    client = FakeGenaiClient(latency=0.0, jitter=0.0, failure_rate=1.0)
+    results = run_batch(client, [{'text_content': synthetic_text(2, seed=6), 'num_open_questions': 2}])
+
+    assert results[0]['status'] == 'error'
+    assert 'questions' not in results[0]
+
+
+def test_complete_generation_is_reported_as_a_success():
+    client = FakeGenaiClient(latency=0.0, jitter=0.0)
+    results = run_batch(client, [{'text_content': synthetic_text(2, seed=7), 'num_open_questions': 2}])
+
+    assert results[0]['status'] == 'success'
+    assert len(results[0]['questions']) == 2
+
+
+def test_abandoned_batch_closes_the_sessions_of_queued_items():
+    client = FakeGenaiClient(latency=0.05, jitter=0.0)
+    rag_service = StubTextRAGService()
+    generator = QCMGenerator(client=client, rag_service=rag_service)
+    batch_generator = BatchGenerator(generator, max_workers=1)
+    items = batch_generator.validate([{'text_content': synthetic_text(2, seed=seed), 'num_open_questions': 1}
+                                      for seed in range(5)])
+
+    results = batch_generator.run(items, use_cache=False)
+    next(results)
+    # Client disconnects: generations that have not started are cancelled
+    results.close()
+    batch_generator.executor.shutdown(wait=True)
+
+    assert rag_service.released == len(items)
@@ -0,0 +1,37 @@
+from langchain_core.documents import Document
+
+from benchmarks.corpus import synthetic_text
+from service.context_packer import ContextPacker
+from service.rag_service import make_text_splitter
+
+
+def test_token_splitter_chunks_are_all_packed():
+    text = synthetic_text(2, seed=3)
+    # Overlap in tokens, far fewer than the characters it spans
+    splitter = make_text_splitter(64, 16, "all-MiniLM-L6-v2")
+    chunks = splitter.split_documents([Document(page_content=text, metadata={'page': 0})])
+    assert len(chunks) > 2
+
+    for chunk in chunks:
+        start = chunk.metadata['start_index']
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+
+    blocks, stats = ContextPacker().pack(chunks, "gemini-2.0-flash", budget=100_000)
+    packed = "\n".join(blocks)
+    assert all(chunk.page_content in packed for chunk in chunks)
+    assert stats['blocks'] == 1
+
+
+def test_chunks_with_a_wrong_offset_are_kept():
+    text = synthetic_text(1, seed=4)
+    first, second, third = text[:400], text[300:700], text[600:1000]
+    chunks = [
+        Document(page_content=first, metadata={'page': 0, 'start_index': 0}),
+        # A stale offset and the -1 recorded for a chunk that was not found
+        Document(page_content=second, metadata={'page': 0, 'start_index': 0}),
+        Document(page_content=third, metadata={'page': 0, 'start_index': -1}),
+    ]
+
+    blocks, _ = ContextPacker().pack(chunks, "gemini-2.0-flash", budget=100_000)
+    packed = "\n".join(blocks)
+    assert all(chunk.page_content.strip() in packed for chunk in chunks)
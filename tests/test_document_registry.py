@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+
+from service.document_registry import DocumentRegistry
+
+
+class StubChromaClient:
+    def __init__(self, collections=()):
+        self.collections = set(collections)
+        self.deleted = []
+
+    def get_collection(self, name):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist")
+        return name
+
+    def delete_collection(self, name):
+        self.collections.discard(name)
+        self.deleted.append(name)
+
+
+def make_registry(tmp_path, **kwargs):
+    client = StubChromaClient()
+    registry = DocumentRegistry(client, str(tmp_path / "registry.sqlite"), **kwargs)
+    return registry, client
+
+
+def test_re_registering_keeps_the_ttl_start(tmp_path):
+    registry, _ = make_registry(tmp_path, ttl_seconds=3600)
+    registry.register("doc", {'status': 'ingesting'}, 10)
+    (created_at,) = registry._conn.execute("SELECT created_at FROM documents").fetchone()
+
+    registry.register("doc", {'status': 'done'}, 20)
+
+    assert registry._conn.execute("SELECT created_at FROM documents").fetchone() == (created_at,)
+    assert registry.get("doc")['metadata'] == {'status': 'done'}
+
+
+def test_expired_document_with_an_open_session_is_kept_until_unpinned(tmp_path):
+    registry, client = make_registry(tmp_path, ttl_seconds=3600)
+    registry.register("doc", {'status': 'done'}, 10)
+    entry = registry.get("doc", pin=True)
+    assert entry is not None
+
+    registry.ttl_seconds = 0
+    assert registry.get("doc") is not None
+    assert client.deleted == []
+
+    registry.unpin(entry['lease'])
+    assert registry.get("doc") is None
+    assert client.deleted == [DocumentRegistry.collection_name("doc")]
+
+
+def test_pins_are_shared_by_registries_on_the_same_file(tmp_path):
+    # Two worker processes, each with its own connection to the registry
+    registry, client = make_registry(tmp_path, ttl_seconds=0)
+    other, _ = make_registry(tmp_path, ttl_seconds=0)
+    other.chroma_client = client
+    registry.register("doc", {'status': 'done'}, 10)
+    lease = registry.pin("doc")
+
+    assert other.get("doc") is not None
+    assert client.deleted == []
+
+    registry.unpin(lease)
+    assert other.get("doc") is None
+
+
+def test_lapsed_pin_of_a_crashed_process_no_longer_protects_the_document(tmp_path):
+    registry, client = make_registry(tmp_path, ttl_seconds=0, pin_lease_seconds=0)
+    registry.register("doc", {'status': 'done'}, 10)
+    registry.pin("doc")
+
+    assert registry.get("doc") is None
+    assert client.deleted == [DocumentRegistry.collection_name("doc")]
+
+
+def test_eviction_skips_documents_whose_lock_is_taken(tmp_path):
+    busy = {"old"}
+
+    @contextmanager
+    def lock_document(document_id):
+        yield document_id not in busy
+
+    registry, client = make_registry(tmp_path, max_documents=1, lock_document=lock_document)
+    registry.register("old", {'status': 'done'}, 10)
+    registry.register("new", {'status': 'done'}, 10)
+    assert client.deleted == []
+
+    busy.clear()
+    registry.register("newest", {'status': 'done'}, 10)
+    assert sorted(client.deleted) == sorted(DocumentRegistry.collection_name(d) for d in ("old", "new"))
+
+
+def test_unregistered_collection_of_a_crashed_writer_is_dropped(tmp_path):
+    registry, client = make_registry(tmp_path)
+    client.collections.add(DocumentRegistry.collection_name("crashed"))
+
+    assert registry.drop_orphan_collection("crashed")
+    assert client.deleted == [DocumentRegistry.collection_name("crashed")]
+    assert not registry.drop_orphan_collection("never-written")
@@ -0,0 +1,121 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from service.llm_gateway import LLMDeadlineExceeded, LLMGateway, TokenBucket
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class ScriptedModels:
+    """Raises or returns the scripted outcomes in order, one per call"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def generate_content(self, model, contents, config=None):
+        return SimpleNamespace(text=self._next(), usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config=None):
+        for text in self._next():
+            if isinstance(text, Exception):
+                raise text
+            yield SimpleNamespace(text=text, usage_metadata=None)
+
+
+def make_gateway(outcomes, **kwargs):
+    models = ScriptedModels(outcomes)
+    # No backoff sleep between retries
+    gateway = LLMGateway([SimpleNamespace(models=models)], backoff_base=0.0, **kwargs)
+    return gateway, models
+
+
+def test_unavailable_model_is_retried_until_it_answers():
+    gateway, models = make_gateway([ApiError(503), ApiError(503), "answer"])
+
+    response = gateway.generate_content("model", "prompt")
+
+    assert response.text == "answer"
+    assert models.calls == 3
+    assert gateway.stats()['retries'] == 2
+    assert gateway.stats()['in_flight'] == 0
+
+
+def test_bad_request_is_not_retried():
+    gateway, models = make_gateway([ApiError(400), "answer"])
+
+    with pytest.raises(ApiError):
+        gateway.generate_content("model", "prompt")
+
+    assert models.calls == 1
+    assert gateway.stats()['failures'] == 1
+
+
+def test_deadline_hit_waiting_for_a_slot_gives_the_reserved_tokens_back():
+    gateway, models = make_gateway(["answer"], max_concurrency=1, requests_per_minute=60, tokens_per_minute=60)
+    tokens_before = gateway._token_bucket.tokens
+    requests_before = gateway._request_bucket.tokens
+    # Another call holds the only slot
+    gateway._slots.acquire()
+
+    with pytest.raises(LLMDeadlineExceeded):
+        gateway.generate_content("model", "x" * 400, deadline=time.monotonic() + 0.05)
+
+    assert models.calls == 0
+    assert gateway._token_bucket.tokens == pytest.approx(tokens_before, abs=1)
+    assert gateway._request_bucket.tokens == pytest.approx(requests_before, abs=1)
+    assert gateway.stats()['deadline_exceeded'] == 1
+
+
+def test_stream_error_after_the_first_chunk_is_raised_without_retry():
+    gateway, models = make_gateway([["first", ApiError(503)], ["retried"]])
+
+    chunks = []
+    with pytest.raises(ApiError):
+        for chunk in gateway.generate_content_stream("model", "prompt"):
+            chunks.append(chunk.text)
+
+    assert chunks == ["first"]
+    assert models.calls == 1
+    assert gateway.stats()['in_flight'] == 0
+
+
+def test_token_bucket_reserve_and_adjust():
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+    now = bucket.updated
+
+    assert bucket.reserve(4, now) == 0.0
+    # 6 tokens left: 2 more are owed, refilled at one per second
+    assert bucket.reserve(8, now) == pytest.approx(2.0)
+    bucket.adjust(-5, now)
+    assert bucket.tokens == pytest.approx(3.0)
+    # Refunds never fill the bucket above its capacity
+    bucket.adjust(-100, now + 1)
+    assert bucket.tokens == 10
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ApiError(429), True),
+    (ApiError(503), True),
+    (ApiError(400), False),
+    (ApiError(404), False),
+    (TimeoutError(), True),
+    (ConnectionError(), True),
+    (type("ReadTimeout", (Exception,), {})(), True),
+    (ValueError("bad json"), False),
+])
+def test_is_retryable(error, retryable):
+    assert LLMGateway.is_retryable(error) is retryable
@@ -0,0 +1,32 @@
+import json
+import threading
+
+from service.metadata_store import MetadataStore
+
+
+def test_concurrent_stores_import_legacy_json_once(tmp_path):
+    legacy_path = tmp_path / "document_metadata.json"
+    entries = [{'document_id': f"doc{i}", 'filename': f"{i}.pdf"} for i in range(50)]
+    legacy_path.write_text(json.dumps(entries))
+    db_path = str(tmp_path / "document_metadata.sqlite")
+
+    # Worker processes open the same store at the same time
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def open_store():
+        try:
+            barrier.wait()
+            MetadataStore(db_path, str(legacy_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=open_store) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert MetadataStore(db_path, str(legacy_path)).list_entries(limit=None)[1] == len(entries)
+    assert not legacy_path.exists()
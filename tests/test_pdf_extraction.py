@@ -0,0 +1,26 @@
+from pypdf import PdfReader
+
+from benchmarks.corpus import synthetic_pages, write_pdf
+from service.pdf_extraction import PdfExtractor, page_digest
+
+
+def test_font_encoding_changes_the_page_digest(tmp_path):
+    path = tmp_path / "win.pdf"
+    write_pdf(str(path), ["Café crème"])
+    other = tmp_path / "mac.pdf"
+    other.write_bytes(path.read_bytes().replace(b"/WinAnsiEncoding", b"/MacRomanEncoding"))
+
+    digests = [page_digest(PdfReader(str(pdf)).pages[0]) for pdf in (path, other)]
+    assert digests[0] != digests[1]
+    assert page_digest(PdfReader(str(path)).pages[0]) == digests[0]
+
+
+def test_pool_extraction_matches_in_process_extraction(tmp_path):
+    path = str(tmp_path / "course.pdf")
+    write_pdf(path, synthetic_pages(12, seed=5))
+
+    expected = PdfExtractor(max_processes=1).extract(path)
+    # One run of two pages in flight at a time
+    pooled = PdfExtractor(max_processes=2, pages_per_task=2, min_pages_for_pool=1, max_tasks_in_flight=1).extract(path)
+    assert [(page.page_content, page.metadata) for page in pooled] == \
+        [(page.page_content, page.metadata) for page in expected]
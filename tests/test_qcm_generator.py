@@ -0,0 +1,171 @@
+import hashlib
+import json
+import threading
+
+from langchain_core.documents import Document
+
+from benchmarks.corpus import synthetic_text
+from benchmarks.fake_llm import FakeGenaiClient
+from service.document_session import DocumentSession
+from service.llm_gimi import QCMGenerator
+
+
+class StubEmbeddingEngine:
+    def embed_documents(self, texts):
+        # Distinct texts get unrelated vectors, so no question is a duplicate
+        return [[byte / 255 for byte in hashlib.sha256(text.encode("utf-8")).digest()[:16]] for text in texts]
+
+
+class StubRAGService:
+    """Serves the session's documents as context, without embedding model or vector store"""
+
+    retrieval_strategy = "mmr"
+    embedding_engine = StubEmbeddingEngine()
+
+    def get_context_documents(self, session, question_type, num_questions, strategy=None):
+        return list(session.documents)
+
+
+def test_free_form_output_generates_complete_question_sets():
+    generator = QCMGenerator(structured_output=False, client=FakeGenaiClient(latency=0.0, jitter=0.0),
+                             rag_service=StubRAGService(), questions_per_batch=2)
+    text = synthetic_text(4, seed=1)
+    session = DocumentSession.create("doc", {'index': 'inline'}, None, documents=[Document(page_content=text)])
+
+    generation_metadata = {}
+    questions = generator.generate_questions_from_text("", num_open_questions=3, num_yes_no_questions=2,
+                                                       use_cache=False, generation_metadata=generation_metadata,
+                                                       session=session)
+
+    assert generation_metadata['status']['open'] == {'status': 'complete', 'requested': 3, 'generated': 3}
+    assert generation_metadata['status']['yes_no'] == {'status': 'complete', 'requested': 2, 'generated': 2}
+    assert [question['type'] for question in questions] == ['open'] * 3 + ['yes_no'] * 2
+
+
+def test_questions_of_a_document_being_ingested_are_not_cached():
+    generator = QCMGenerator(client=FakeGenaiClient(latency=0.0, jitter=0.0), rag_service=StubRAGService())
+    text = synthetic_text(4, seed=2)
+    metadata = {'index': 'persistent', 'status': 'ingesting'}
+    session = DocumentSession.create("partial", metadata, None, documents=[Document(page_content=text)])
+
+    generation_metadata = {}
+    generator.generate_questions_from_text("", num_open_questions=2, generation_metadata=generation_metadata,
+                                           session=session)
+    assert generation_metadata['status']['open']['status'] == 'complete'
+
+    generation_metadata = {}
+    generator.generate_questions_from_text("", num_open_questions=2, generation_metadata=generation_metadata,
+                                           session=session)
+    assert generation_metadata['cache']['open'] == 'miss'
+
+
+def stream_questions(client, **counts):
+    generator = QCMGenerator(client=client, rag_service=StubRAGService())
+    session = DocumentSession.create("doc", {'index': 'inline'}, None,
+                                     documents=[Document(page_content=synthetic_text(4, seed=3))])
+    generation_metadata = {}
+    questions = list(generator.stream_questions_from_text("", use_cache=False, session=session,
+                                                          generation_metadata=generation_metadata, **counts))
+    return questions, generation_metadata
+
+
+def test_stream_reports_complete_question_sets():
+    questions, generation_metadata = stream_questions(FakeGenaiClient(latency=0.0, jitter=0.0),
+                                                      num_open_questions=2, num_yes_no_questions=1)
+
+    assert len(questions) == 3
+    assert generation_metadata['status']['open'] == {'status': 'complete', 'requested': 2, 'generated': 2}
+    assert generation_metadata['status']['yes_no'] == {'status': 'complete', 'requested': 1, 'generated': 1}
+
+
+def test_stream_reports_failed_generation():
+    class FailingModels:
+        def generate_content_stream(self, **kwargs):
+            raise RuntimeError("quota exhausted")
+
+    class FailingClient:
+        models = FailingModels()
+
+    questions, generation_metadata = stream_questions(FailingClient(), num_open_questions=2)
+
+    assert questions == []
+    assert generation_metadata['status']['open']['status'] == 'failed'
+    assert "quota exhausted" in generation_metadata['errors']['open']
+
+
+def test_stream_drops_duplicate_questions_like_generation():
+    class Chunk:
+        usage_metadata = None
+
+        def __init__(self, text):
+            self.text = text
+
+    class RepeatingModels:
+        """Answers with the same question twice, then a distinct one"""
+
+        def _questions(self):
+            questions = [{'question': f"What is {topic}?", 'reference_answer': f"{topic} is described."}
+                         for topic in ("alpha", "alpha", "beta")]
+            return json.dumps({'questions': questions})
+
+        def generate_content_stream(self, **kwargs):
+            text = self._questions()
+            for i in range(0, len(text), 20):
+                yield Chunk(text[i:i + 20])
+
+        def generate_content(self, **kwargs):
+            return Chunk(self._questions())
+
+    class RepeatingClient:
+        models = RepeatingModels()
+
+    streamed, generation_metadata = stream_questions(RepeatingClient(), num_open_questions=2)
+
+    generator = QCMGenerator(client=RepeatingClient(), rag_service=StubRAGService())
+    session = DocumentSession.create("doc", {'index': 'inline'}, None,
+                                     documents=[Document(page_content=synthetic_text(4, seed=3))])
+    generated = generator.generate_questions_from_text("", num_open_questions=2, use_cache=False, session=session)
+
+    assert [question['question'] for question in streamed] == ["What is alpha?", "What is beta?"]
+    assert [question['question'] for question in generated] == [question['question'] for question in streamed]
+    assert generation_metadata['status']['open']['status'] == 'complete'
+
+
+def test_timed_out_branches_keep_the_owned_session_until_they_finish():
+    released = threading.Event()
+
+    class TextRAGService(StubRAGService):
+        def process_text(self, text):
+            return DocumentSession.create(None, {'index': 'ephemeral'}, None, documents=[Document(page_content=text)],
+                                          release=released.set)
+
+    generator = QCMGenerator(request_timeout=0.1, client=FakeGenaiClient(latency=0.5, jitter=0.0),
+                             rag_service=TextRAGService())
+    generation_metadata = {}
+    questions = generator.generate_questions_from_text(synthetic_text(2, seed=4), num_open_questions=2, use_cache=False,
+                                                       generation_metadata=generation_metadata)
+
+    assert questions == []
+    assert generation_metadata['status']['open']['status'] == 'timeout'
+    # The branch is still querying the session
+    assert not released.is_set()
+    generator.executor.shutdown(wait=True)
+    assert released.is_set()
+    # The late branch leaves the returned request's metadata alone
+    assert generation_metadata['status']['open']['status'] == 'timeout'
+    assert generation_metadata['context'] == {}
+
+
+def test_failed_generation_has_an_error_outcome():
+    generator = QCMGenerator(client=FakeGenaiClient(latency=0.0, jitter=0.0, failure_rate=1.0),
+                             rag_service=StubRAGService(), max_parse_retries=0)
+    session = DocumentSession.create("doc", {'index': 'inline'}, None,
+                                     documents=[Document(page_content=synthetic_text(2, seed=5))])
+
+    generation_metadata = {}
+    questions = generator.generate_questions_from_text("", num_open_questions=2, use_cache=False,
+                                                       generation_metadata=generation_metadata, session=session)
+
+    assert questions == []
+    assert generation_metadata['status']['open']['status'] == 'failed'
+    assert QCMGenerator.generation_outcome(generation_metadata['status'], len(questions)) == 'error'
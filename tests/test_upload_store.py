@@ -0,0 +1,63 @@
+import io
+import os
+import time
+
+from service.upload_store import UploadStore
+
+
+def make_store(tmp_path, **kwargs):
+    # No cleanup on save, the tests run it explicitly
+    return UploadStore(str(tmp_path / "uploads"), cleanup_interval=3600, **kwargs)
+
+
+def save(store, content, age_seconds):
+    stored = store.save(io.BytesIO(content))
+    used_at = time.time() - age_seconds
+    os.utime(stored.path, (used_at, used_at))
+    return stored
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = make_store(tmp_path)
+    first = store.save(io.BytesIO(b"same pdf"))
+    second = store.save(io.BytesIO(b"same pdf"))
+
+    assert second.path == first.path
+    assert second.duplicate and not first.duplicate
+
+
+def test_cleanup_removes_expired_files_unless_pinned(tmp_path):
+    store = make_store(tmp_path, max_age_seconds=3600)
+    expired = save(store, b"expired", 7200)
+    pinned = save(store, b"pinned", 7200)
+    recent = save(store, b"recent", 60)
+
+    with store.pinned(pinned.path):
+        result = store.cleanup()
+
+    assert result['removed'] == 1
+    assert not os.path.exists(expired.path)
+    assert os.path.exists(pinned.path)
+    assert os.path.exists(recent.path)
+
+
+def test_quota_evicts_least_recently_used_files_old_enough(tmp_path):
+    store = make_store(tmp_path, max_bytes=10, min_age_seconds=600)
+    oldest = save(store, b"a" * 6, 3000)
+    pinned = save(store, b"b" * 6, 2000)
+    older = save(store, b"c" * 6, 1000)
+    fresh = save(store, b"d" * 6, 10)
+
+    store.pin(pinned.path)
+    result = store.cleanup()
+
+    # Pinned and fresh files count towards the quota but are kept
+    assert not os.path.exists(oldest.path)
+    assert not os.path.exists(older.path)
+    assert os.path.exists(pinned.path)
+    assert os.path.exists(fresh.path)
+    assert result == {'removed': 2, 'freed_bytes': 12, 'total_bytes': 12}
+
+    store.unpin(pinned.path)
+    assert store.cleanup()['removed'] == 1
+    assert not os.path.exists(pinned.path)